@@ -9,8 +9,12 @@ from datetime import datetime
 # Add src to path
 sys.path.append(os.path.dirname(__file__))
 
-from src.trading_bot import TradingBotV2, BotConfig, create_bot_from_env
-from src.models import TradingMode
+from src.trading_bot import TradingBotV2, BotConfig, create_bot_from_env, load_env_settings
+from src.models import TradingMode, AccountInfo, OrderSide
+from src.data_feed.market_data import MarketDataFeed
+from src.strategy.smc_strategy import SMCStrategy
+from src.risk_management.risk_manager import RiskManager
+from src.order_manager.order_manager import OrderManager
 from src.monitoring.logger import TradingLogger
 
 
@@ -53,11 +57,9 @@ def test_individual_modules():
     logger = TradingLogger("ModuleTest")
     logger.info("🧪 Testing Individual Modules...")
     
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    api_key = os.getenv("API_KEY")
-    api_secret = os.getenv("API_SECRET")
+    settings = load_env_settings()
+    api_key = settings.api_key
+    api_secret = settings.api_secret
     
     if not api_key or not api_secret:
         logger.error("❌ Missing API credentials")
@@ -65,8 +67,6 @@ def test_individual_modules():
     
     # Test Data Feed
     logger.info("1️⃣ Testing Data Feed...")
-    from src.data_feed.market_data import MarketDataFeed
-    
     data_feed = MarketDataFeed(api_key, api_secret, testnet=True)
     candles = data_feed.get_candles("BTCUSDT", "15", 50)
     market_data = data_feed.get_market_data("BTCUSDT")
@@ -79,8 +79,6 @@ def test_individual_modules():
     
     # Test Strategy
     logger.info("2️⃣ Testing SMC Strategy...")
-    from src.strategy.smc_strategy import SMCStrategy
-    
     strategy = SMCStrategy("BTCUSDT")
     signal = strategy.process_signal(candles, market_data)
     
@@ -88,9 +86,6 @@ def test_individual_modules():
     
     # Test Risk Manager
     logger.info("3️⃣ Testing Risk Manager...")
-    from src.risk_management.risk_manager import RiskManager
-    from src.models import AccountInfo
-    
     risk_manager = RiskManager()
     
     mock_account = AccountInfo(
@@ -107,9 +102,6 @@ def test_individual_modules():
     
     # Test Order Manager
     logger.info("4️⃣ Testing Order Manager...")
-    from src.order_manager.order_manager import OrderManager
-    from src.models import OrderSide
-    
     order_manager = OrderManager(api_key, api_secret, testnet=True, trading_mode=TradingMode.PAPER)
     
     # Test paper order
@@ -180,14 +172,19 @@ def run_live_demo():
     
     # Let it run for 2 minutes
     demo_duration = 120  # seconds
-    start_time = time.time()
+    status_interval = 30  # seconds
+    deadline = time.monotonic() + demo_duration
     
     try:
-        while time.time() - start_time < demo_duration:
-            time.sleep(10)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            
+            # Ngủ thẳng đến lần in status kế tiếp (hoặc hết giờ demo)
+            time.sleep(min(status_interval, remaining))
             
-            # Show status every 30 seconds
-            if int(time.time() - start_time) % 30 == 0:
+            if time.monotonic() < deadline:
                 status = bot.get_bot_status()
                 logger.info(f"📊 Status Update: {status}")
         
@@ -0,0 +1,47 @@
+"""
+Bybit HTTP client dùng chung cho toàn bộ bot
+"""
+import random
+from functools import lru_cache
+from typing import Optional
+
+from pybit.unified_trading import HTTP
+from requests.adapters import HTTPAdapter
+
+# Kích thước connection pool cho session dùng chung (DataFeed + OrderManager + update thread)
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 8
+
+# Retry REST: 0.5s, 1s, ... + tối đa 0.25s jitter
+RETRY_BASE_DELAY = 0.5
+RETRY_JITTER = 0.25
+
+
+def backoff_delay(attempt: int) -> float:
+    """Thời gian chờ trước lần retry kế tiếp (exponential + jitter, tránh retry đồng loạt)"""
+    return RETRY_BASE_DELAY * (1 << attempt) + random.random() * RETRY_JITTER
+
+
+@lru_cache(maxsize=None)
+def get_http_session(api_key: Optional[str], api_secret: Optional[str], testnet: bool = True) -> HTTP:
+    """
+    Lấy HTTP client dùng chung cho một bộ credentials
+
+    DataFeed và OrderManager dùng chung instance này nên dùng chung
+    requests.Session (keep-alive pool) bên trong pybit. Gọi get_server_time
+    một lần để DNS + TCP/TLS handshake xong trước request đầu tiên của bot.
+    """
+    session = HTTP(testnet=testnet, api_key=api_key, api_secret=api_secret)
+
+    # Keep-alive pool cố định cho các request đồng thời từ nhiều thread
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.client.mount("https://", adapter)
+    session.client.headers.update({"Connection": "keep-alive"})
+
+    try:
+        session.get_server_time()
+    except Exception:
+        # Warm-up không bắt buộc - request thật sẽ tự kết nối lại
+        pass
+
+    return session
@@ -3,14 +3,22 @@ Market Data Feed - Quản lý dữ liệu thị trường real-time
 """
 import time
 import threading
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Callable
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Optional, Callable, Tuple
 import pandas as pd
-from pybit.unified_trading import HTTP
+import numpy as np
 
 from ..models import Candle, MarketData
+from pybit.unified_trading import WebSocket
+
+from ..bybit_client import get_http_session, backoff_delay
 from ..monitoring.logger import TradingLogger
 
+# Candle cache: TTL 30s (monotonic ns), tối đa 64 key (LRU)
+CANDLE_CACHE_TTL_NS = 30 * 1_000_000_000
+CANDLE_CACHE_MAX_KEYS = 64
+
 
 class MarketDataFeed:
     """
@@ -32,27 +40,30 @@ class MarketDataFeed:
         self.logger = TradingLogger("DataFeed")
         
         # Data cache
-        self.candle_cache: Dict[str, pd.DataFrame] = {}
+        self.candle_cache: "OrderedDict[str, Tuple[int, pd.DataFrame]]" = OrderedDict()  # key -> (expiry_ns, df)
+        self._cache_lock = threading.Lock()  # kline WS thread cũng ghi candle_cache
         self.market_data_cache: Dict[str, MarketData] = {}
         
-        # Callbacks
-        self.price_callbacks: List[Callable] = []
-        self.candle_callbacks: List[Callable] = []
+        # Callbacks (tuple copy-on-write - thread đọc không cần lock)
+        self.price_callbacks: Tuple[Callable, ...] = ()
+        self.candle_callbacks: Tuple[Callable, ...] = ()
         
         # Threading
         self.is_running = False
         self.update_thread = None
         
+        # WebSocket (push ticker + nến đóng)
+        self.ws = None
+        self.ticker_state: Dict[str, Dict] = {}
+        self._ticker_stream_live = False
+        self._kline_stream_live = False
+        
         self._connect()
     
     def _connect(self):
         """Kết nối đến Bybit API"""
         try:
-            self.session = HTTP(
-                testnet=self.testnet,
-                api_key=self.api_key,
-                api_secret=self.api_secret
-            )
+            self.session = get_http_session(self.api_key, self.api_secret, self.testnet)
             self.logger.info("Kết nối Bybit API thành công")
         except Exception as e:
             self.logger.error(f"Lỗi kết nối API: {e}")
@@ -68,53 +79,39 @@ class MarketDataFeed:
             limit: Số nến (tối đa 1000)
             
         Returns:
-            DataFrame với columns: timestamp, open, high, low, close, volume
+            DataFrame với columns: timestamp (epoch ms, int64), open, high, low, close, volume
         """
         try:
             cache_key = f"{symbol}_{interval}_{limit}"
+            with self._cache_lock:
+                entry = self.candle_cache.get(cache_key)
+                
+                # Kiểm tra cache (cache 30s)
+                if entry is not None and entry[0] > time.monotonic_ns():
+                    self.candle_cache.move_to_end(cache_key)
+                    return entry[1]
             
-            # Kiểm tra cache (cache 30s)
-            if cache_key in self.candle_cache:
-                cached_df = self.candle_cache[cache_key]
-                if not cached_df.empty:
-                    last_update = cached_df.attrs.get('last_update', datetime.min)
-                    if datetime.now() - last_update < timedelta(seconds=30):
-                        return cached_df
-            
-            # Lấy data từ API với retry
-            response = self._retry_api_call(
-                self.session.get_kline,
-                category="linear",
-                symbol=symbol,
-                interval=interval,
-                limit=limit
-            )
-            
-            if not response or response.get('retCode') != 0:
-                self.logger.error(f"Lỗi lấy dữ liệu nến: {response}")
-                return pd.DataFrame()
-            
-            # Convert sang DataFrame
-            candles_data = response['result']['list']
-            df = pd.DataFrame(candles_data, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume', 'turnover'
-            ])
+            cached_df = entry[1] if entry is not None else None
             
-            # Data processing
-            for col in ['open', 'high', 'low', 'close', 'volume']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+            df = None
             
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df = df.sort_values('timestamp').reset_index(drop=True)
+            # Cache đã đủ nến -> chỉ lấy 2 nến mới nhất và ghép vào cuối
+            if cached_df is not None and len(cached_df) == limit and limit > 2:
+                latest_df = self._fetch_candles(symbol, interval, 2)
+                if latest_df is not None:
+                    df = self._merge_candles(cached_df, latest_df, limit)
             
-            # Validation
-            if not self._validate_candle_data(df):
-                self.logger.warning("Dữ liệu nến không hợp lệ")
-                return pd.DataFrame()
+            if df is None:
+                df = self._fetch_candles(symbol, interval, limit)
+                if df is None:
+                    return pd.DataFrame()
             
             # Cache data
-            df.attrs['last_update'] = datetime.now()
-            self.candle_cache[cache_key] = df
+            with self._cache_lock:
+                self.candle_cache[cache_key] = (time.monotonic_ns() + CANDLE_CACHE_TTL_NS, df)
+                self.candle_cache.move_to_end(cache_key)
+                if len(self.candle_cache) > CANDLE_CACHE_MAX_KEYS:
+                    self.candle_cache.popitem(last=False)
             
             self.logger.debug(f"Lấy {len(df)} nến cho {symbol} thành công")
             return df
@@ -123,6 +120,62 @@ class MarketDataFeed:
             self.logger.error(f"Lỗi get_candles: {e}")
             return pd.DataFrame()
     
+    def _fetch_candles(self, symbol: str, interval: str, limit: int) -> Optional[pd.DataFrame]:
+        """Gọi API lấy nến và chuyển sang DataFrame đã sort + validate"""
+        # Lấy data từ API với retry
+        response = self._retry_api_call(
+            self.session.get_kline,
+            category="linear",
+            symbol=symbol,
+            interval=interval,
+            limit=limit
+        )
+        
+        if not response or response.get('retCode') != 0:
+            self.logger.error(f"Lỗi lấy dữ liệu nến: {response}")
+            return None
+        
+        candles_data = response['result']['list']
+        if not candles_data:
+            self.logger.warning("Dữ liệu nến không hợp lệ")
+            return None
+        
+        # Parse một lần sang mảng số - Bybit trả nến mới nhất trước nên chỉ cần đảo ngược
+        # (O(N), không sort); kiểm tra 2 đầu mảng phòng khi thứ tự API thay đổi
+        raw = np.asarray(candles_data)
+        if int(raw[0, 0]) > int(raw[-1, 0]):
+            raw = raw[::-1]
+        timestamps = raw[:, 0].astype(np.int64)
+        ohlcv = raw[:, 1:6].astype(np.float64)
+        
+        # Convert sang DataFrame
+        df = pd.DataFrame(ohlcv, columns=['open', 'high', 'low', 'close', 'volume'])
+        df.insert(0, 'timestamp', timestamps)
+        
+        # Validation
+        if not self._validate_candle_data(df):
+            self.logger.warning("Dữ liệu nến không hợp lệ")
+            return None
+        
+        return df
+    
+    def _merge_candles(self, cached_df: pd.DataFrame, latest_df: pd.DataFrame,
+                       limit: int) -> Optional[pd.DataFrame]:
+        """
+        Ghép các nến mới nhất vào cache, ghi đè nến trùng timestamp
+        
+        Returns:
+            None nếu giữa cache và nến mới bị hụt nến (cần tải lại toàn bộ)
+        """
+        first_new = latest_df['timestamp'].iloc[0]
+        if first_new > cached_df['timestamp'].iloc[-1]:
+            return None
+        
+        kept = cached_df[cached_df['timestamp'] < first_new]
+        merged = pd.concat([kept, latest_df], ignore_index=True)
+        
+        return merged.iloc[-limit:].reset_index(drop=True)
+    
     def get_current_price(self, symbol: str) -> Optional[float]:
         """Lấy giá hiện tại"""
         try:
@@ -141,8 +194,19 @@ class MarketDataFeed:
         
         return None
     
-    def get_market_data(self, symbol: str) -> Optional[MarketData]:
-        """Lấy thông tin thị trường đầy đủ"""
+    def get_market_data(self, symbol: str, max_age: Optional[float] = None) -> Optional[MarketData]:
+        """
+        Lấy thông tin thị trường đầy đủ
+        
+        Args:
+            max_age: Nếu có, dùng market_data_cache (WebSocket/update loop) khi
+                     dữ liệu cache chưa cũ hơn max_age giây thay vì gọi REST
+        """
+        if max_age is not None:
+            cached = self.market_data_cache.get(symbol)
+            if cached is not None and (datetime.now() - cached.timestamp).total_seconds() < max_age:
+                return cached
+        
         try:
             response = self._retry_api_call(
                 self.session.get_tickers,
@@ -154,15 +218,7 @@ class MarketDataFeed:
                 return None
             
             ticker = response['result']['list'][0]
-            
-            market_data = MarketData(
-                symbol=symbol,
-                current_price=float(ticker['lastPrice']),
-                bid=float(ticker['bid1Price']) if ticker.get('bid1Price') else 0,
-                ask=float(ticker['ask1Price']) if ticker.get('ask1Price') else 0,
-                volume_24h=float(ticker['volume24h']) if ticker.get('volume24h') else 0,
-                change_24h=float(ticker['price24hPcnt']) if ticker.get('price24hPcnt') else 0
-            )
+            market_data = self._parse_ticker(symbol, ticker)
             
             # Cache
             self.market_data_cache[symbol] = market_data
@@ -173,6 +229,50 @@ class MarketDataFeed:
             self.logger.error(f"Lỗi lấy market data: {e}")
             return None
     
+    def get_all_tickers(self, symbols: List[str]) -> Dict[str, MarketData]:
+        """
+        Lấy market data cho nhiều symbols bằng một request get_tickers
+        
+        Returns:
+            Dict symbol -> MarketData (chỉ các symbols được yêu cầu)
+        """
+        try:
+            response = self._retry_api_call(
+                self.session.get_tickers,
+                category="linear"
+            )
+            
+            if not response or response.get('retCode') != 0:
+                return {}
+            
+            wanted = set(symbols)
+            result = {}
+            for ticker in response['result']['list']:
+                symbol = ticker['symbol']
+                if symbol in wanted:
+                    result[symbol] = self._parse_ticker(symbol, ticker)
+            
+            # Cache
+            self.market_data_cache.update(result)
+            
+            return result
+            
+        except Exception as e:
+            self.logger.error(f"Lỗi lấy tickers: {e}")
+            return {}
+    
+    @staticmethod
+    def _parse_ticker(symbol: str, ticker: Dict) -> MarketData:
+        """Chuyển ticker Bybit (REST hoặc WebSocket) sang MarketData"""
+        return MarketData(
+            symbol=symbol,
+            current_price=float(ticker['lastPrice']),
+            bid=float(ticker['bid1Price']) if ticker.get('bid1Price') else 0,
+            ask=float(ticker['ask1Price']) if ticker.get('ask1Price') else 0,
+            volume_24h=float(ticker['volume24h']) if ticker.get('volume24h') else 0,
+            change_24h=float(ticker['price24hPcnt']) if ticker.get('price24hPcnt') else 0
+        )
+    
     def start_real_time_updates(self, symbols: List[str], interval: int = 5):
         """
         Bắt đầu cập nhật dữ liệu real-time
@@ -189,54 +289,190 @@ class MarketDataFeed:
         self.symbols_to_track = symbols
         self.update_interval = interval
         
+        # Ưu tiên WebSocket push; thread polling bù cho stream chưa chạy (ticker hoặc nến)
+        # và tự dừng khi cả ticker lẫn kline stream đều đã subscribe
+        self._ticker_stream_live = self._start_ticker_stream(symbols)
+        
         self.update_thread = threading.Thread(
             target=self._update_loop,
             daemon=True
         )
         self.update_thread.start()
         
-        self.logger.info(f"Bắt đầu real-time updates cho {symbols}")
+        mode = "WebSocket" if self._ticker_stream_live else "REST polling"
+        self.logger.info(f"Bắt đầu real-time updates ({mode}) cho {symbols}")
     
     def stop_real_time_updates(self):
         """Dừng cập nhật real-time"""
         self.is_running = False
         if self.update_thread:
             self.update_thread.join()
+            self.update_thread = None
+        if self.ws:
+            self.ws.exit()
+            self.ws = None
+        self._ticker_stream_live = False
+        self._kline_stream_live = False
         self.logger.info("Dừng real-time updates")
     
+    def _start_ticker_stream(self, symbols: List[str]) -> bool:
+        """Subscribe tickers WebSocket cho các symbols"""
+        try:
+            if self.ws is None:
+                self.ws = WebSocket(testnet=self.testnet, channel_type="linear")
+            
+            self.ws.ticker_stream(symbol=symbols, callback=self._handle_ticker_message)
+            return True
+            
+        except Exception as e:
+            self.logger.warning(f"Không mở được ticker WebSocket, dùng REST polling: {e}")
+            return False
+    
+    def _handle_ticker_message(self, message: Dict):
+        """Xử lý ticker push - snapshot rồi delta (chỉ gửi field thay đổi)"""
+        try:
+            ticker = message['data']
+            symbol = ticker['symbol']
+            
+            state = self.ticker_state.setdefault(symbol, {})
+            state.update(ticker)
+            
+            if not state.get('lastPrice'):
+                return
+            
+            market_data = self._parse_ticker(symbol, state)
+            self.market_data_cache[symbol] = market_data
+            
+            self._safe_dispatch(self.price_callbacks, "price", market_data)
+                    
+        except Exception as e:
+            self.logger.error(f"Lỗi xử lý ticker message: {e}")
+    
+    def start_kline_stream(self, symbol: str, interval: str) -> bool:
+        """
+        Subscribe kline WebSocket - gọi candle callbacks ngay khi nến đóng
+        
+        Returns:
+            False nếu không kết nối được (caller tiếp tục dùng polling)
+        """
+        try:
+            if self.ws is None:
+                self.ws = WebSocket(testnet=self.testnet, channel_type="linear")
+            
+            self.ws.kline_stream(interval=interval, symbol=symbol, callback=self._handle_kline_message)
+            self._kline_stream_live = True
+            self.logger.info(f"Subscribe kline.{interval}.{symbol} qua WebSocket")
+            return True
+            
+        except Exception as e:
+            self.logger.warning(f"Không mở được kline WebSocket, candle callbacks dùng REST polling: {e}")
+            return False
+    
+    def _handle_kline_message(self, message: Dict):
+        """Xử lý kline push - chỉ quan tâm nến đã đóng (confirm=true)"""
+        try:
+            symbol = message['topic'].split('.')[-1]
+            
+            for kline in message['data']:
+                if not kline.get('confirm'):
+                    continue
+                
+                # Nến cache đã cũ -> lần get_candles tới sẽ refresh
+                self._expire_candle_cache(symbol, str(kline['interval']))
+                
+                candles = pd.DataFrame({
+                    'timestamp': np.array([int(kline['start'])], dtype=np.int64),
+                    'open': [float(kline['open'])],
+                    'high': [float(kline['high'])],
+                    'low': [float(kline['low'])],
+                    'close': [float(kline['close'])],
+                    'volume': [float(kline['volume'])]
+                })
+                
+                self._safe_dispatch(self.candle_callbacks, "candle", symbol, candles)
+                        
+        except Exception as e:
+            self.logger.error(f"Lỗi xử lý kline message: {e}")
+    
+    def _expire_candle_cache(self, symbol: str, interval: str):
+        """Đánh dấu cache nến của symbol/interval là hết hạn"""
+        prefix = f"{symbol}_{interval}_"
+        with self._cache_lock:
+            for cache_key, (_, cached_df) in list(self.candle_cache.items()):
+                if cache_key.startswith(prefix):
+                    # Giữ DataFrame để lần refresh sau chỉ cần ghép nến mới
+                    self.candle_cache[cache_key] = (0, cached_df)
+    
+    def invalidate_symbol(self, symbol: str):
+        """Xoá toàn bộ candle cache của một symbol"""
+        prefix = f"{symbol}_"
+        with self._cache_lock:
+            for cache_key in [key for key in self.candle_cache if key.startswith(prefix)]:
+                self.candle_cache.pop(cache_key, None)
+    
     def add_price_callback(self, callback: Callable):
         """Thêm callback khi có cập nhật giá"""
-        self.price_callbacks.append(callback)
+        self.price_callbacks = (*self.price_callbacks, callback)
     
     def add_candle_callback(self, callback: Callable):
         """Thêm callback khi có nến mới"""
-        self.candle_callbacks.append(callback)
+        self.candle_callbacks = (*self.candle_callbacks, callback)
+    
+    def _safe_dispatch(self, callbacks: Tuple[Callable, ...], kind: str, *args):
+        """Gọi lần lượt các callbacks - lỗi của một callback không chặn các callback khác"""
+        for callback in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                self.logger.error(f"Lỗi {kind} callback: {e}")
     
     def _update_loop(self):
         """Vòng lặp cập nhật dữ liệu"""
+        # Lịch theo monotonic clock - không lệch theo thời gian gọi API
+        next_tick = time.monotonic()
+        next_candle = next_tick + 60.0
+        
         while self.is_running:
+            # Ticker và nến đều đã có WebSocket push -> không cần polling nữa
+            if self._ticker_stream_live and self._kline_stream_live:
+                self.logger.info("Ticker + kline WebSocket đang chạy, dừng REST polling")
+                return
+            
+            # Snapshot callbacks một lần mỗi vòng
+            price_cbs = self.price_callbacks
+            candle_cbs = self.candle_callbacks
+            
             try:
+                poll_prices = not self._ticker_stream_live
+                
+                # Cập nhật candle data (mỗi phút) khi chưa có kline stream
+                refresh_candles = not self._kline_stream_live and time.monotonic() >= next_candle
+                if refresh_candles:
+                    next_candle = time.monotonic() + 60.0
+                
+                # Nhiều symbols -> một request get_tickers cho tất cả
+                if poll_prices and len(self.symbols_to_track) > 1:
+                    tickers = self.get_all_tickers(self.symbols_to_track)
+                else:
+                    tickers = None
+                
                 for symbol in self.symbols_to_track:
                     # Cập nhật market data
-                    market_data = self.get_market_data(symbol)
-                    if market_data:
-                        for callback in self.price_callbacks:
-                            try:
-                                callback(market_data)
-                            except Exception as e:
-                                self.logger.error(f"Lỗi price callback: {e}")
+                    if poll_prices:
+                        if tickers is not None:
+                            market_data = tickers.get(symbol)
+                        else:
+                            market_data = self.get_market_data(symbol)
+                        if market_data:
+                            self._safe_dispatch(price_cbs, "price", market_data)
                     
-                    # Cập nhật candle data (mỗi phút)
-                    if int(time.time()) % 60 == 0:
+                    if refresh_candles:
                         candles = self.get_candles(symbol, "1", 2)  # 2 nến gần nhất
                         if not candles.empty:
-                            for callback in self.candle_callbacks:
-                                try:
-                                    callback(symbol, candles)
-                                except Exception as e:
-                                    self.logger.error(f"Lỗi candle callback: {e}")
+                            self._safe_dispatch(candle_cbs, "candle", symbol, candles)
                 
-                time.sleep(self.update_interval)
+                next_tick = max(next_tick + self.update_interval, time.monotonic())
+                time.sleep(max(0.0, next_tick - time.monotonic()))
                 
             except Exception as e:
                 self.logger.error(f"Lỗi update loop: {e}")
@@ -247,16 +483,14 @@ class MarketDataFeed:
         if df.empty:
             return False
         
-        required_cols = ['open', 'high', 'low', 'close', 'volume']
-        if not all(col in df.columns for col in required_cols):
+        o, h, l, c = (df[col].to_numpy() for col in ('open', 'high', 'low', 'close'))
+        
+        if np.isnan(c).any():
+            self.logger.warning("Phát hiện giá close NaN")
             return False
         
         # Kiểm tra OHLC logic
-        invalid_rows = (
-            (df['high'] < df[['open', 'close']].max(axis=1)) |
-            (df['low'] > df[['open', 'close']].min(axis=1)) |
-            (df['high'] < df['low'])
-        )
+        invalid_rows = (h < np.maximum(o, c)) | (l > np.minimum(o, c)) | (h < l)
         
         if invalid_rows.any():
             self.logger.warning(f"Phát hiện {invalid_rows.sum()} nến không hợp lệ")
@@ -265,30 +499,29 @@ class MarketDataFeed:
         return True
     
     def _retry_api_call(self, func, max_retries: int = 3, **kwargs):
-        """Retry API call với exponential backoff"""
+        """Retry API call với exponential backoff + jitter"""
         for attempt in range(max_retries):
             try:
-                if attempt > 0:
-                    delay = 2 ** attempt
-                    self.logger.debug(f"Retry {attempt + 1}, chờ {delay}s...")
-                    time.sleep(delay)
-                
-                result = func(**kwargs)
-                return result
+                return func(**kwargs)
                 
             except Exception as e:
-                error_msg = str(e)
-                self.logger.warning(f"API call attempt {attempt + 1} failed: {error_msg}")
+                self.logger.warning(f"API call attempt {attempt + 1} failed: {e}")
                 
                 if attempt == max_retries - 1:
-                    raise e
+                    raise
+                
+                delay = backoff_delay(attempt)
+                self.logger.debug(f"Retry {attempt + 2}, chờ {delay:.2f}s...")
+                time.sleep(delay)
         
         return None
     
     def get_cache_info(self) -> Dict:
         """Thông tin cache hiện tại"""
+        with self._cache_lock:
+            candle_keys = list(self.candle_cache.keys())
         return {
-            'candle_cache_keys': list(self.candle_cache.keys()),
+            'candle_cache_keys': candle_keys,
             'market_data_cache': list(self.market_data_cache.keys()),
             'is_running': self.is_running
         }
\ No newline at end of file
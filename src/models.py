@@ -1,13 +1,34 @@
 """
 Base models và data types cho trading system
 """
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import datetime
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
 from enum import Enum
 from typing import Optional, Dict, Any, List
+import numpy as np
 import pandas as pd
 
 
+def _add_slots(cls):
+    """
+    Tạo lại dataclass với __slots__ (tương đương dataclass(slots=True) của Python 3.10+)
+    
+    Instance không còn __dict__ -> nhẹ hơn và truy cập attribute nhanh hơn.
+    Default của field đã nằm trong __init__ sinh ra nên có thể bỏ khỏi class.
+    """
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(f.name for f in fields(cls))
+    
+    cls_dict['__slots__'] = field_names
+    for name in field_names:
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
 class OrderSide(Enum):
     """Hướng lệnh"""
     BUY = "Buy"
@@ -49,6 +70,7 @@ class MarketStructure(Enum):
     NEUTRAL = "NEUTRAL"
 
 
+@_add_slots
 @dataclass
 class Candle:
     """Dữ liệu nến"""
@@ -61,7 +83,35 @@ class Candle:
     symbol: str
 
 
-@dataclass  
+@dataclass
+class CandleArray:
+    """Dữ liệu nến dạng cột (SoA) - mỗi field là một mảng NumPy"""
+    timestamp: Optional[np.ndarray]  # epoch ms (int64)
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    
+    def __len__(self) -> int:
+        return len(self.close)
+    
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> 'CandleArray':
+        """Tạo từ DataFrame OHLCV (MarketDataFeed.get_candles)"""
+        return cls(
+            timestamp=df['timestamp'].to_numpy() if 'timestamp' in df.columns else None,
+            open=df['open'].to_numpy(dtype=np.float64),
+            high=df['high'].to_numpy(dtype=np.float64),
+            low=df['low'].to_numpy(dtype=np.float64),
+            close=df['close'].to_numpy(dtype=np.float64),
+            volume=(df['volume'].to_numpy(dtype=np.float64) if 'volume' in df.columns
+                    else np.zeros(len(df)))
+        )
+
+
+@_add_slots
+@dataclass
 class OrderBlock:
     """Order Block SMC"""
     type: str  # BULLISH_OB, BEARISH_OB
@@ -72,6 +122,7 @@ class OrderBlock:
     confidence: float
 
 
+@_add_slots
 @dataclass
 class FairValueGap:
     """Fair Value Gap"""
@@ -82,6 +133,7 @@ class FairValueGap:
     filled: bool = False
 
 
+@_add_slots
 @dataclass
 class TradingSignal:
     """Tín hiệu trading"""
@@ -102,6 +154,7 @@ class TradingSignal:
             self.metadata = {}
 
 
+@_add_slots
 @dataclass
 class Position:
     """Vị thế giao dịch"""
@@ -116,6 +169,7 @@ class Position:
     take_profit: Optional[float] = None
 
 
+@_add_slots
 @dataclass
 class Order:
     """Lệnh giao dịch"""
@@ -135,6 +189,7 @@ class Order:
             self.timestamp = datetime.now()
 
 
+@_add_slots
 @dataclass
 class Trade:
     """Giao dịch đã thực hiện"""
@@ -148,6 +203,49 @@ class Trade:
     order_id: str
 
 
+@_add_slots
+@dataclass
+class SymbolSpec:
+    """
+    Thông số lệnh của một symbol (từ instruments info)
+    
+    qty_step/tick_size = None khi chưa lấy được instruments info:
+    khi đó gửi str(value) như cũ thay vì đoán precision của symbol khác.
+    """
+    symbol: str
+    qty_step: Optional[Decimal]
+    tick_size: Optional[Decimal]
+    min_qty: Decimal
+    max_qty: Decimal
+    
+    @staticmethod
+    def _snap(value: float, step: Decimal, rounding: str) -> Decimal:
+        """Đưa value về bội số của step (Decimal để không lệch do sai số float)"""
+        return (Decimal(str(float(value))) / step).to_integral_value(rounding) * step
+    
+    def snap_qty(self, quantity: float) -> Decimal:
+        """Quantity làm tròn xuống bội số qtyStep (không vượt size đã tính theo risk)"""
+        if self.qty_step is None:
+            return Decimal(str(float(quantity)))
+        return self._snap(quantity, self.qty_step, ROUND_DOWN)
+    
+    def is_valid_qty(self, quantity: float) -> bool:
+        """Quantity sẽ gửi đi (sau khi làm tròn theo qtyStep) nằm trong [minOrderQty, maxOrderQty]"""
+        return self.min_qty <= self.snap_qty(quantity) <= self.max_qty
+    
+    def format_qty(self, quantity: float) -> str:
+        """Quantity dạng chuỗi theo qtyStep của symbol"""
+        if self.qty_step is None:
+            return str(quantity)
+        return f"{self.snap_qty(quantity):f}"
+    
+    def format_price(self, price: float) -> str:
+        """Giá làm tròn về tickSize gần nhất"""
+        if self.tick_size is None:
+            return str(price)
+        return f"{self._snap(price, self.tick_size, ROUND_HALF_UP):f}"
+
+
 @dataclass
 class AccountInfo:
     """Thông tin tài khoản"""
@@ -163,6 +261,7 @@ class AccountInfo:
             self.timestamp = datetime.now()
 
 
+@_add_slots
 @dataclass
 class MarketData:
     """Dữ liệu thị trường"""
@@ -1,13 +1,127 @@
 """
 Trading Logger - Hệ thống logging chuyên nghiệp cho trading bot
 """
+import atexit
 import logging
+import logging.handlers
 import os
-from datetime import datetime
-from typing import Optional, Dict, Any
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
 import json
 
 
+# Handlers dùng chung cho mọi TradingLogger: (log_dir, loại, ngày) -> handler
+_SHARED_HANDLERS: Dict[Tuple[str, str, str], logging.Handler] = {}
+# QueueHandler theo (log_dir, ngày) - handlers thật chạy trong thread của QueueListener
+_QUEUE_HANDLERS: Dict[Tuple[str, str], logging.Handler] = {}
+_HANDLER_LOCK = threading.RLock()
+
+_FORMATTER = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+# Chuỗi ngày hiện tại (giờ local) được cache tới nửa đêm kế tiếp
+_DAY_STR = ""
+_DAY_END_NS = 0
+
+
+def _today() -> str:
+    """Ngày hiện tại dạng YYYY-MM-DD, chỉ gọi datetime.now() khi sang ngày mới"""
+    global _DAY_STR, _DAY_END_NS
+    if time.time_ns() >= _DAY_END_NS:
+        now = datetime.now()
+        midnight = datetime(now.year, now.month, now.day) + timedelta(days=1)
+        _DAY_STR = now.strftime('%Y-%m-%d')
+        _DAY_END_NS = int(midnight.timestamp()) * 1_000_000_000
+    return _DAY_STR
+
+
+def _get_shared_handlers(log_dir: str, today: str) -> List[logging.Handler]:
+    """Console + file + error handlers, mỗi loại chỉ mở một lần cho cả process"""
+    specs = [
+        ('console', logging.INFO, None),
+        ('trading', logging.DEBUG, os.path.join(log_dir, f'trading_{today}.log')),
+        ('errors', logging.ERROR, os.path.join(log_dir, f'errors_{today}.log')),
+    ]
+    
+    handlers = []
+    with _HANDLER_LOCK:
+        for kind, level, path in specs:
+            key = (log_dir, kind, today) if path else ('', kind, '')
+            handler = _SHARED_HANDLERS.get(key)
+            if handler is None:
+                handler = logging.FileHandler(path) if path else logging.StreamHandler()
+                handler.setLevel(level)
+                handler.setFormatter(_FORMATTER)
+                _SHARED_HANDLERS[key] = handler
+            handlers.append(handler)
+    
+    return handlers
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler chỉ chốt nội dung message trước khi enqueue
+    
+    Args (kể cả _LazyJson) được render trên thread gọi log vì dict extra của
+    caller có thể bị sửa sau đó; format dòng log + ghi file vẫn ở thread listener.
+    Queue chỉ dùng trong process nên không cần copy record như QueueHandler gốc.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _get_queue_handler(log_dir: str, today: str) -> logging.Handler:
+    """Handler duy nhất gắn vào logger - chỉ enqueue record, không I/O"""
+    key = (log_dir, today)
+    with _HANDLER_LOCK:
+        handler = _QUEUE_HANDLERS.get(key)
+        if handler is None:
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(
+                log_queue, *_get_shared_handlers(log_dir, today), respect_handler_level=True
+            )
+            listener.start()
+            atexit.register(listener.stop)
+            
+            handler = _DeferredQueueHandler(log_queue)
+            _QUEUE_HANDLERS[key] = handler
+    
+    return handler
+
+
+class _LazyJson:
+    """Serialize extra data chỉ khi record thật sự được handler xử lý (cache kết quả)"""
+    __slots__ = ('data', '_text')
+    
+    def __init__(self, data: Dict):
+        self.data = data
+        self._text = None
+    
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self.data, indent=2, default=str)
+        return self._text
+
+
+class _IsoTime:
+    """Timestamp (time_ns) chỉ được format isoformat khi record được serialize"""
+    __slots__ = ('ns',)
+    
+    def __init__(self, ns: int):
+        self.ns = ns
+    
+    def __str__(self) -> str:
+        return datetime.fromtimestamp(self.ns / 1e9).isoformat()
+
+
 class TradingLogger:
     """
     Logger chuyên dụng cho trading system
@@ -38,34 +152,8 @@ class TradingLogger:
         if logger.handlers:
             return logger
         
-        # Formatter
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        
-        # Console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        
-        # File handler cho tất cả logs
-        today = datetime.now().strftime('%Y-%m-%d')
-        file_handler = logging.FileHandler(
-            os.path.join(self.log_dir, f'trading_{today}.log')
-        )
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        
-        # Error file handler
-        error_handler = logging.FileHandler(
-            os.path.join(self.log_dir, f'errors_{today}.log')
-        )
-        error_handler.setLevel(logging.ERROR)
-        error_handler.setFormatter(formatter)
-        logger.addHandler(error_handler)
+        # Console, file (tất cả logs) và error handlers dùng chung, ghi qua queue
+        logger.addHandler(_get_queue_handler(self.log_dir, _today()))
         
         return logger
     
@@ -98,7 +186,7 @@ class TradingLogger:
             'side': side,
             'quantity': quantity,
             'price': price,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': _IsoTime(time.time_ns()),
             **kwargs
         }
         
@@ -113,7 +201,7 @@ class TradingLogger:
             'symbol': symbol,
             'confidence': confidence,
             'reason': reason,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': _IsoTime(time.time_ns()),
             **kwargs
         }
         
@@ -129,14 +217,14 @@ class TradingLogger:
     
     def _log(self, level: int, message: str, extra: Optional[Dict] = None):
         """Internal logging method"""
+        if not self.logger.isEnabledFor(level):
+            return
+        
         if extra:
-            # Thêm extra data vào message nếu cần
-            extra_str = json.dumps(extra, indent=2) if extra else ""
-            full_message = f"{message}\nExtra: {extra_str}" if extra_str else message
+            # Extra data chỉ được json.dumps khi record được enqueue
+            self.logger.log(level, "%s\nExtra: %s", message, _LazyJson(extra))
         else:
-            full_message = message
-        
-        self.logger.log(level, full_message)
+            self.logger.log(level, message)
 
 
 # Global logger instance
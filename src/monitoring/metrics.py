@@ -2,16 +2,19 @@
 Performance Metrics - Theo dõi hiệu suất trading
 """
 import time
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 
-from ..models import Trade, BacktestResult
+from ..models import Trade, BacktestResult, OrderSide, _add_slots
 from .logger import TradingLogger
 
 
+@_add_slots
 @dataclass
 class PerformanceSnapshot:
     """Snapshot hiệu suất tại một thời điểm"""
@@ -27,6 +30,8 @@ class PerformanceSnapshot:
     avg_win: float
     avg_loss: float
     sharpe_ratio: float
+    total_wins: float = 0.0
+    total_losses: float = 0.0
     
     @property
     def profit_factor(self) -> float:
@@ -34,9 +39,40 @@ class PerformanceSnapshot:
         if self.losing_trades == 0:
             return float('inf') if self.winning_trades > 0 else 0
         
-        total_wins = self.winning_trades * self.avg_win
-        total_losses = abs(self.losing_trades * self.avg_loss)
-        return total_wins / total_losses if total_losses > 0 else 0
+        return self.total_wins / self.total_losses if self.total_losses > 0 else 0
+
+
+# Số trades gần nhất giữ trong RAM (export / daily summary)
+MAX_TRADE_HISTORY = 10_000
+
+
+class _SeriesBuffer:
+    """Chuỗi (timestamp ns, giá trị) dạng SoA: 2 mảng numpy, tăng gấp đôi khi đầy"""
+    __slots__ = ('ts', 'values', 'size')
+    
+    def __init__(self, capacity: int = 1024):
+        self.ts = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+    
+    def append(self, timestamp: datetime, value: float):
+        if self.size == len(self.values):
+            capacity = 2 * len(self.values)
+            self.ts = np.resize(self.ts, capacity)
+            self.values = np.resize(self.values, capacity)
+        self.ts[self.size] = int(timestamp.timestamp() * 1_000_000_000)
+        self.values[self.size] = value
+        self.size += 1
+    
+    def clear(self):
+        self.size = 0
+    
+    def to_list(self) -> List[Tuple[datetime, float]]:
+        """Chuyển về list (datetime, value) - chỉ dùng cho báo cáo/debug"""
+        return [
+            (datetime.fromtimestamp(ts / 1e9), float(value))
+            for ts, value in zip(self.ts[:self.size], self.values[:self.size])
+        ]
 
 
 class PerformanceMetrics:
@@ -51,31 +87,68 @@ class PerformanceMetrics:
     - Risk-adjusted returns
     """
     
-    def __init__(self, initial_balance: float = 10000.0):
+    def __init__(self, initial_balance: float = 10000.0, max_trades: int = MAX_TRADE_HISTORY):
         self.initial_balance = initial_balance
         self.current_balance = initial_balance
         self.logger = TradingLogger("Metrics")
         
         # Trade history
-        self.trades: List[Trade] = []
-        self.balance_history: List[Tuple[datetime, float]] = []
-        self.drawdown_history: List[Tuple[datetime, float]] = []
+        # Chỉ giữ max_trades trades gần nhất trong RAM (mọi fill đã được ghi vào trading log);
+        # thống kê tổng dùng các biến cộng dồn nên không phụ thuộc vào giới hạn này
+        self.trades: Deque[Trade] = deque(maxlen=max_trades)
+        self._trade_pnls: Deque[float] = deque(maxlen=max_trades)  # P&L từng trade, tính một lần trong add_trade
+        self._trade_days: Deque[int] = deque(maxlen=max_trades)  # date ordinal, tăng dần theo thứ tự fill
+        self._trade_count = 0
+        
+        # Lots đang mở theo symbol (FIFO): [quantity, price], cùng một side
+        self._lots: Dict[str, Deque[List[float]]] = defaultdict(deque)
+        self._lot_sides: Dict[str, OrderSide] = {}
+        self._balance_series = _SeriesBuffer()
+        self._drawdown_series = _SeriesBuffer()
         
         # Running metrics
         self.peak_balance = initial_balance
         self.max_drawdown = 0.0
         self.start_time = datetime.now()
         
+        # Tổng win/loss cộng dồn - get_current_metrics không phải duyệt lại trades
+        self._win_count = 0
+        self._loss_count = 0
+        self._total_wins = 0.0
+        self._total_losses = 0.0
+        
+        # Mean/M2 của returns cập nhật online (Welford) cho Sharpe ratio
+        self._ret_n = 0
+        self._ret_mean = 0.0
+        self._ret_m2 = 0.0
+        self._last_balance = initial_balance
+        
+        # Snapshot gần nhất, key = (số trades, balance, peak)
+        self._snapshot_key: Optional[Tuple[int, float, float]] = None
+        self._snapshot: Optional[PerformanceSnapshot] = None
+        
         # Add initial balance point
-        self.balance_history.append((self.start_time, initial_balance))
+        self._balance_series.append(self.start_time, initial_balance)
+    
+    @property
+    def balance_history(self) -> List[Tuple[datetime, float]]:
+        """Lịch sử balance dạng list (datetime, balance)"""
+        return self._balance_series.to_list()
+    
+    @property
+    def drawdown_history(self) -> List[Tuple[datetime, float]]:
+        """Lịch sử drawdown dạng list (datetime, drawdown)"""
+        return self._drawdown_series.to_list()
     
     def add_trade(self, trade: Trade, current_balance: float):
         """Thêm trade mới và cập nhật metrics"""
         self.trades.append(trade)
+        self._trade_count += 1
         self.current_balance = current_balance
         
         # Update balance history
-        self.balance_history.append((trade.timestamp, current_balance))
+        self._balance_series.append(trade.timestamp, current_balance)
+        self._update_returns(current_balance)
         
         # Update peak and drawdown
         if current_balance > self.peak_balance:
@@ -85,10 +158,20 @@ class PerformanceMetrics:
         if current_drawdown > self.max_drawdown:
             self.max_drawdown = current_drawdown
         
-        self.drawdown_history.append((trade.timestamp, current_drawdown))
+        self._drawdown_series.append(trade.timestamp, current_drawdown)
         
-        # Log trade
+        # P&L tính một lần, dùng lại cho mọi aggregate
         pnl = self._calculate_trade_pnl(trade)
+        self._trade_pnls.append(pnl)
+        self._trade_days.append(trade.timestamp.toordinal())
+        if pnl > 0:
+            self._win_count += 1
+            self._total_wins += pnl
+        elif pnl < 0:
+            self._loss_count += 1
+            self._total_losses += abs(pnl)
+        
+        # Log trade
         self.logger.trade_log(
             "FILL",
             trade.symbol,
@@ -101,7 +184,12 @@ class PerformanceMetrics:
     
     def get_current_metrics(self) -> PerformanceSnapshot:
         """Lấy metrics hiện tại"""
-        if not self.trades:
+        # Giữa hai trade metrics không đổi -> dùng lại snapshot, chỉ cập nhật timestamp
+        key = (self._trade_count, self.current_balance, self.peak_balance)
+        if key == self._snapshot_key:
+            return replace(self._snapshot, timestamp=datetime.now())
+        
+        if not self._trade_count:
             return PerformanceSnapshot(
                 timestamp=datetime.now(),
                 total_trades=0,
@@ -117,22 +205,13 @@ class PerformanceMetrics:
                 sharpe_ratio=0
             )
         
-        # Tính toán basic metrics
-        winning_trades = 0
-        losing_trades = 0
-        total_wins = 0
-        total_losses = 0
-        
-        for trade in self.trades:
-            pnl = self._calculate_trade_pnl(trade)
-            if pnl > 0:
-                winning_trades += 1
-                total_wins += pnl
-            elif pnl < 0:
-                losing_trades += 1
-                total_losses += abs(pnl)
-        
-        total_trades = len(self.trades)
+        # Tính toán basic metrics từ tổng cộng dồn
+        winning_trades = self._win_count
+        losing_trades = self._loss_count
+        total_wins = self._total_wins
+        total_losses = self._total_losses
+        
+        total_trades = self._trade_count
         win_rate = (winning_trades / total_trades) * 100 if total_trades > 0 else 0
         avg_win = total_wins / winning_trades if winning_trades > 0 else 0
         avg_loss = total_losses / losing_trades if losing_trades > 0 else 0
@@ -140,7 +219,7 @@ class PerformanceMetrics:
         total_pnl = self.current_balance - self.initial_balance
         sharpe_ratio = self._calculate_sharpe_ratio()
         
-        return PerformanceSnapshot(
+        snapshot = PerformanceSnapshot(
             timestamp=datetime.now(),
             total_trades=total_trades,
             winning_trades=winning_trades, 
@@ -152,18 +231,28 @@ class PerformanceMetrics:
             win_rate=win_rate,
             avg_win=avg_win,
             avg_loss=avg_loss,
-            sharpe_ratio=sharpe_ratio
+            sharpe_ratio=sharpe_ratio,
+            total_wins=total_wins,
+            total_losses=total_losses
         )
+        
+        self._snapshot_key = key
+        self._snapshot = snapshot
+        return snapshot
     
     def get_daily_summary(self) -> Dict:
         """Tóm tắt hiệu suất hôm nay"""
         today = datetime.now().date()
-        today_trades = [
-            trade for trade in self.trades 
-            if trade.timestamp.date() == today
-        ]
         
-        if not today_trades:
+        # Trades được thêm theo thứ tự thời gian -> trades hôm nay nằm cuối deque
+        today_ordinal = today.toordinal()
+        today_pnls = []
+        for day, pnl in zip(reversed(self._trade_days), reversed(self._trade_pnls)):
+            if day < today_ordinal:
+                break
+            today_pnls.append(pnl)
+        
+        if not today_pnls:
             return {
                 'date': today.isoformat(),
                 'trades': 0,
@@ -171,13 +260,13 @@ class PerformanceMetrics:
                 'win_rate': 0
             }
         
-        total_pnl = sum(self._calculate_trade_pnl(trade) for trade in today_trades)
-        winning_trades = sum(1 for trade in today_trades if self._calculate_trade_pnl(trade) > 0)
-        win_rate = (winning_trades / len(today_trades)) * 100
+        total_pnl = sum(today_pnls)
+        winning_trades = sum(1 for pnl in today_pnls if pnl > 0)
+        win_rate = (winning_trades / len(today_pnls)) * 100
         
         return {
             'date': today.isoformat(),
-            'trades': len(today_trades),
+            'trades': len(today_pnls),
             'pnl': total_pnl,
             'win_rate': win_rate,
             'balance': self.current_balance
@@ -203,28 +292,66 @@ class PerformanceMetrics:
         return report
     
     def _calculate_trade_pnl(self, trade: Trade) -> float:
-        """Tính P&L của một trade"""
-        # TODO: Implement based on position tracking
-        # For now, assume simple calculation
-        return 0.0
+        """
+        Tính realized P&L của một trade theo FIFO lots
+        
+        Cập nhật lots đang mở nên chỉ gọi một lần cho mỗi trade (trong add_trade).
+        Trade mở/thêm position có P&L = 0; trade đóng trừ commission.
+        """
+        symbol = trade.symbol
+        lots = self._lots[symbol]
+        open_side = self._lot_sides.get(symbol)
+        
+        if not lots or open_side is trade.side:
+            lots.append([trade.quantity, trade.price])
+            self._lot_sides[symbol] = trade.side
+            return 0.0
+        
+        # Đóng lots cũ nhất trước
+        sign = 1.0 if open_side is OrderSide.BUY else -1.0
+        remaining = trade.quantity
+        realized = 0.0
+        
+        while remaining > 1e-12 and lots:
+            lot = lots[0]
+            matched = min(remaining, lot[0])
+            realized += (trade.price - lot[1]) * matched * sign
+            lot[0] -= matched
+            remaining -= matched
+            if lot[0] <= 1e-12:
+                lots.popleft()
+        
+        # Phần còn lại đảo chiều position
+        if remaining > 1e-12:
+            lots.append([remaining, trade.price])
+            self._lot_sides[symbol] = trade.side
+        
+        return realized - trade.commission
+    
+    def _update_returns(self, balance: float):
+        """Cập nhật mean/M2 của returns với balance mới (Welford, O(1))"""
+        if self._last_balance:
+            r = (balance - self._last_balance) / self._last_balance
+            self._ret_n += 1
+            delta = r - self._ret_mean
+            self._ret_mean += delta / self._ret_n
+            self._ret_m2 += delta * (r - self._ret_mean)
+        self._last_balance = balance
     
     def _calculate_sharpe_ratio(self, risk_free_rate: float = 0.02) -> float:
         """Tính Sharpe Ratio"""
-        if len(self.balance_history) < 2:
+        if self._ret_n < 2:
             return 0.0
         
-        # Tính returns
-        balances = [balance for _, balance in self.balance_history]
-        returns = pd.Series(balances).pct_change().dropna()
-        
-        if returns.empty or returns.std() == 0:
+        std = np.sqrt(self._ret_m2 / (self._ret_n - 1))
+        if std == 0:
             return 0.0
         
         # Annualized metrics
-        mean_return = returns.mean() * 252  # Daily to annual
-        volatility = returns.std() * np.sqrt(252)
+        mean_return = self._ret_mean * 252  # Daily to annual
+        volatility = std * np.sqrt(252)
         
-        return (mean_return - risk_free_rate) / volatility if volatility > 0 else 0.0
+        return float((mean_return - risk_free_rate) / volatility) if volatility > 0 else 0.0
     
     def export_trades_to_csv(self, filename: Optional[str] = None) -> str:
         """Export trades ra CSV file"""
@@ -236,38 +363,59 @@ class PerformanceMetrics:
             self.logger.warning("Không có trades để export")
             return filename
         
-        # Convert trades to DataFrame
-        trades_data = []
-        for trade in self.trades:
-            trades_data.append({
-                'timestamp': trade.timestamp,
-                'symbol': trade.symbol,
-                'side': trade.side.value,
-                'quantity': trade.quantity,
-                'price': trade.price,
-                'commission': trade.commission,
-                'pnl': self._calculate_trade_pnl(trade)
-            })
-        
-        df = pd.DataFrame(trades_data)
-        df.to_csv(filename, index=False)
-        
-        self.logger.info(f"Exported {len(trades_data)} trades to {filename}")
+        # Convert trades to DataFrame theo cột (không tạo dict cho từng trade)
+        trades = self.trades
+        df = pd.DataFrame({
+            'timestamp': [trade.timestamp for trade in trades],
+            'symbol': [trade.symbol for trade in trades],
+            'side': [trade.side.value for trade in trades],
+            'quantity': np.fromiter((trade.quantity for trade in trades), dtype=np.float64, count=len(trades)),
+            'price': np.fromiter((trade.price for trade in trades), dtype=np.float64, count=len(trades)),
+            'commission': np.fromiter((trade.commission for trade in trades), dtype=np.float64, count=len(trades)),
+            'pnl': np.asarray(self._trade_pnls, dtype=np.float64)
+        })
+        df.to_csv(filename, index=False, chunksize=100_000)
+        
+        self.logger.info(f"Exported {len(df)} trades to {filename}")
         return filename
     
     def reset_metrics(self):
         """Reset tất cả metrics"""
         self.trades.clear()
-        self.balance_history.clear()
-        self.drawdown_history.clear()
+        self._trade_pnls.clear()
+        self._trade_days.clear()
+        self._trade_count = 0
+        self._lots.clear()
+        self._lot_sides.clear()
+        self._balance_series.clear()
+        self._drawdown_series.clear()
         self.current_balance = self.initial_balance
         self.peak_balance = self.initial_balance
         self.max_drawdown = 0.0
+        self._win_count = 0
+        self._loss_count = 0
+        self._total_wins = 0.0
+        self._total_losses = 0.0
         self.start_time = datetime.now()
-        self.balance_history.append((self.start_time, self.initial_balance))
+        self._balance_series.append(self.start_time, self.initial_balance)
+        self._ret_n = 0
+        self._ret_mean = 0.0
+        self._ret_m2 = 0.0
+        self._last_balance = self.initial_balance
+        self._snapshot_key = None
+        self._snapshot = None
         
         self.logger.info("Reset performance metrics")
 
 
-# Singleton instance
-performance_tracker = PerformanceMetrics()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_tracker() -> PerformanceMetrics:
+    """Singleton PerformanceMetrics - chỉ khởi tạo (logger, buffers) khi được dùng lần đầu"""
+    return PerformanceMetrics()
+
+
+def __getattr__(name: str):
+    """Giữ tương thích với `from .metrics import performance_tracker`"""
+    if name == 'performance_tracker':
+        return get_tracker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
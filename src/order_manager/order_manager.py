@@ -2,17 +2,36 @@
 Order Manager - Quản lý đặt lệnh và theo dõi fills
 """
 import time
+import threading
 import uuid
-from typing import Dict, List, Optional, Callable
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Dict, List, Optional, Callable, Set, Tuple
 from datetime import datetime, timedelta
-from pybit.unified_trading import HTTP
+
+from pybit.unified_trading import WebSocket
 
 from ..models import (
     Order, OrderSide, OrderType, OrderStatus, 
-    TradingSignal, Trade, Position, TradingMode
+    TradingSignal, Trade, Position, TradingMode, SymbolSpec
 )
+from ..bybit_client import get_http_session, backoff_delay
 from ..monitoring.logger import TradingLogger
 
+# Giới hạn quantity mặc định khi chưa lấy được instruments info (min 0.001 như trước đây)
+DEFAULT_MIN_QTY = "0.001"
+DEFAULT_MAX_QTY = "Infinity"
+
+# orderStatus của Bybit -> OrderStatus (các trạng thái khác như Untriggered được bỏ qua)
+_STATUS_BY_VALUE = {status.value: status for status in OrderStatus}
+_DONE_STATUSES = (OrderStatus.FILLED, OrderStatus.CANCELLED, OrderStatus.REJECTED)
+
+# Số update WebSocket giữ lại cho order chưa kịp track (push đến trước response REST)
+MAX_PENDING_UPDATES = 256
+
+# Thời gian (giây) dùng spec mặc định trước khi thử lấy lại instruments info bị lỗi
+SPEC_RETRY_INTERVAL = 60.0
+
 
 class OrderManager:
     """
@@ -45,6 +64,11 @@ class OrderManager:
         self.active_orders: Dict[str, Order] = {}
         self.completed_orders: Dict[str, Order] = {}
         self.trades: List[Trade] = []
+        self._orders_by_symbol: Dict[str, Set[str]] = {}  # symbol -> order_id đang active
+        
+        # Thông số symbol (qtyStep, tickSize, min/max qty) - lấy một lần cho mỗi symbol
+        self._specs: Dict[str, SymbolSpec] = {}
+        self._fallback_specs: Dict[str, Tuple[float, SymbolSpec]] = {}  # symbol -> (hết hạn monotonic, spec)
         
         # Paper trading
         self.paper_balance = 10000.0
@@ -54,23 +78,70 @@ class OrderManager:
         self.fill_callbacks: List[Callable] = []
         self.order_callbacks: List[Callable] = []
         
+        # Private WebSocket (order stream) - None thì dùng REST get_open_orders
+        self.ws = None
+        self._pending_updates: "OrderedDict[str, Dict]" = OrderedDict()
+        # Callback WS chạy trên thread của pybit: lookup/track/pending phải atomic với _track
+        self._order_lock = threading.RLock()
+        
         if trading_mode != TradingMode.PAPER:
             self._connect()
+            self._start_order_stream()
         
         self.logger.info(f"Khởi tạo Order Manager - Mode: {trading_mode.value}")
     
     def _connect(self):
         """Kết nối Bybit API"""
         try:
-            self.session = HTTP(
+            self.session = get_http_session(self.api_key, self.api_secret, self.testnet)
+            self.logger.info("Kết nối Bybit API thành công")
+        except Exception as e:
+            self.logger.error(f"Lỗi kết nối API: {e}")
+            raise
+    
+    def _start_order_stream(self):
+        """Subscribe order stream - trạng thái lệnh được push thay vì poll từng order"""
+        try:
+            self.ws = WebSocket(
                 testnet=self.testnet,
+                channel_type="private",
                 api_key=self.api_key,
                 api_secret=self.api_secret
             )
-            self.logger.info("Kết nối Bybit API thành công")
+            self.ws.order_stream(callback=self._handle_order_message)
+            self.logger.info("Subscribe order stream qua WebSocket")
         except Exception as e:
-            self.logger.error(f"Lỗi kết nối API: {e}")
-            raise
+            self.ws = None
+            self.logger.warning(f"Không mở được order WebSocket, dùng REST: {e}")
+    
+    def stop_order_stream(self):
+        """Đóng order WebSocket"""
+        if self.ws is not None:
+            try:
+                self.ws.exit()
+            except Exception as e:
+                self.logger.warning(f"Lỗi đóng order WebSocket: {e}")
+            self.ws = None
+    
+    def _handle_order_message(self, message: Dict):
+        """Cập nhật active orders từ order stream"""
+        try:
+            with self._order_lock:
+                for order_data in message['data']:
+                    order_id = order_data['orderId']
+                    order = self.active_orders.get(order_id)
+                    
+                    if order is None:
+                        # Có thể push đến trước khi place_order trả về -> áp dụng khi track
+                        self._pending_updates[order_id] = order_data
+                        while len(self._pending_updates) > MAX_PENDING_UPDATES:
+                            self._pending_updates.popitem(last=False)
+                        continue
+                    
+                    self._apply_order_update(order, order_data)
+                
+        except Exception as e:
+            self.logger.error(f"Lỗi xử lý order message: {e}")
     
     def place_market_order(
         self, 
@@ -104,15 +175,24 @@ class OrderManager:
             # Real order placement
             order_id = str(uuid.uuid4())
             
-            # Place main order
-            response = self._retry_api_call(
-                self.session.place_order,
+            spec = self._get_symbol_spec(symbol)
+            
+            # Place main order - SL/TP gắn luôn vào lệnh vào (không chờ fill rồi đặt riêng)
+            params = dict(
                 category="linear",
                 symbol=symbol,
                 side=side.value,
                 orderType="Market",
-                qty=str(quantity)
+                qty=spec.format_qty(quantity)
             )
+            if stop_loss:
+                params.update(stopLoss=spec.format_price(stop_loss), slTriggerBy="LastPrice")
+            if take_profit:
+                params.update(takeProfit=spec.format_price(take_profit), tpTriggerBy="LastPrice")
+            if stop_loss or take_profit:
+                params['tpslMode'] = "Full"
+            
+            response = self._retry_api_call(self.session.place_order, **params)
             
             if not response or response.get('retCode') != 0:
                 self.logger.error(f"Lỗi đặt lệnh market: {response}")
@@ -128,14 +208,11 @@ class OrderManager:
                 status=OrderStatus.NEW
             )
             
-            self.active_orders[order.order_id] = order
+            self._track(order)
             
             self.logger.info(f"✅ Market order placed: {side.value} {quantity} {symbol}")
-            
-            # Place SL/TP orders after a delay
             if stop_loss or take_profit:
-                time.sleep(2)  # Wait for main order to fill
-                self._place_conditional_orders(order, stop_loss, take_profit)
+                self.logger.info(f"✅ SL/TP attached: SL ${stop_loss} | TP ${take_profit}")
             
             return order
             
@@ -158,14 +235,16 @@ class OrderManager:
             if self.trading_mode == TradingMode.PAPER:
                 return self._place_paper_order(symbol, side, OrderType.LIMIT, quantity, price)
             
+            spec = self._get_symbol_spec(symbol)
+            
             response = self._retry_api_call(
                 self.session.place_order,
                 category="linear",
                 symbol=symbol,
                 side=side.value,
                 orderType="Limit",
-                qty=str(quantity),
-                price=str(price)
+                qty=spec.format_qty(quantity),
+                price=spec.format_price(price)
             )
             
             if not response or response.get('retCode') != 0:
@@ -182,7 +261,7 @@ class OrderManager:
                 status=OrderStatus.NEW
             )
             
-            self.active_orders[order.order_id] = order
+            self._track(order)
             
             self.logger.info(f"✅ Limit order placed: {side.value} {quantity} {symbol} @ ${price}")
             return order
@@ -194,12 +273,11 @@ class OrderManager:
     def cancel_order(self, order_id: str) -> bool:
         """Cancel order"""
         try:
-            if order_id not in self.active_orders:
+            order = self.active_orders.get(order_id)
+            if order is None:
                 self.logger.warning(f"Order {order_id} không tồn tại")
                 return False
             
-            order = self.active_orders[order_id]
-            
             if self.trading_mode == TradingMode.PAPER:
                 return self._cancel_paper_order(order_id)
             
@@ -212,8 +290,7 @@ class OrderManager:
             
             if response and response.get('retCode') == 0:
                 order.status = OrderStatus.CANCELLED
-                self.completed_orders[order_id] = order
-                del self.active_orders[order_id]
+                self._untrack(order)
                 
                 self.logger.info(f"✅ Order cancelled: {order_id}")
                 return True
@@ -225,22 +302,29 @@ class OrderManager:
             self.logger.error(f"Lỗi cancel order: {e}")
             return False
     
+    def cancel_all(self, symbol: str) -> int:
+        """Cancel tất cả active orders của một symbol, trả về số lệnh đã cancel"""
+        cancelled = 0
+        with self._order_lock:
+            order_ids = list(self._orders_by_symbol.get(symbol, ()))
+        for order_id in order_ids:
+            if self.cancel_order(order_id):
+                cancelled += 1
+        return cancelled
+    
     def get_order_status(self, order_id: str) -> Optional[Order]:
         """Lấy trạng thái order"""
-        if order_id in self.active_orders:
-            order = self.active_orders[order_id]
-            
-            if self.trading_mode == TradingMode.PAPER:
+        order = self.active_orders.get(order_id)
+        if order is not None:
+            # Paper order hoặc order stream đang chạy -> trạng thái đã mới nhất
+            if self.trading_mode == TradingMode.PAPER or self.ws is not None:
                 return order
             
             # Update từ API
             self._update_order_status(order)
             return order
         
-        elif order_id in self.completed_orders:
-            return self.completed_orders[order_id]
-        
-        return None
+        return self.completed_orders.get(order_id)
     
     def get_positions(self, symbol: Optional[str] = None) -> List[Position]:
         """Lấy danh sách positions"""
@@ -260,19 +344,21 @@ class OrderManager:
             if not response or response.get('retCode') != 0:
                 return []
             
+            # Một timestamp cho cả batch; slot rỗng (size = 0) bị bỏ trước khi parse field khác
+            now = datetime.now()
             positions = []
             for pos_data in response['result']['list']:
-                if float(pos_data['size']) > 0:
-                    position = Position(
+                size = float(pos_data['size'])
+                if size > 0:
+                    positions.append(Position(
                         symbol=pos_data['symbol'],
                         side=OrderSide.BUY if pos_data['side'] == 'Buy' else OrderSide.SELL,
-                        size=float(pos_data['size']),
+                        size=size,
                         entry_price=float(pos_data['avgPrice']),
                         current_price=float(pos_data['markPrice']),
                         unrealized_pnl=float(pos_data['unrealisedPnl']),
-                        timestamp=datetime.now()
-                    )
-                    positions.append(position)
+                        timestamp=now
+                    ))
             
             return positions
             
@@ -366,21 +452,42 @@ class OrderManager:
         if order_id in self.active_orders:
             order = self.active_orders[order_id]
             order.status = OrderStatus.CANCELLED
-            self.completed_orders[order_id] = order
-            del self.active_orders[order_id]
+            self._untrack(order)
             return True
         return False
     
+    def _track(self, order: Order):
+        """Thêm order vào active_orders và index theo symbol"""
+        with self._order_lock:
+            self.active_orders[order.order_id] = order
+            self._orders_by_symbol.setdefault(order.symbol, set()).add(order.order_id)
+            
+            pending = self._pending_updates.pop(order.order_id, None)
+            if pending is not None:
+                self._apply_order_update(order, pending)
+    
+    def _untrack(self, order: Order):
+        """Chuyển order sang completed_orders, gỡ khỏi active_orders và index"""
+        with self._order_lock:
+            self.completed_orders[order.order_id] = order
+            self.active_orders.pop(order.order_id, None)
+            
+            symbol_orders = self._orders_by_symbol.get(order.symbol)
+            if symbol_orders is not None:
+                symbol_orders.discard(order.order_id)
+                if not symbol_orders:
+                    del self._orders_by_symbol[order.symbol]
+    
     def _update_paper_position(self, trade: Trade):
         """Cập nhật paper position"""
         symbol = trade.symbol
+        pos = self.paper_positions.get(symbol)
         
-        if symbol not in self.paper_positions:
+        if pos is None:
             # New position
-            side = trade.side
             self.paper_positions[symbol] = Position(
                 symbol=symbol,
-                side=side,
+                side=trade.side,
                 size=trade.quantity,
                 entry_price=trade.price,
                 current_price=trade.price,
@@ -389,8 +496,6 @@ class OrderManager:
             )
         else:
             # Update existing position
-            pos = self.paper_positions[symbol]
-            
             if pos.side == trade.side:
                 # Add to position
                 total_value = pos.size * pos.entry_price + trade.quantity * trade.price
@@ -413,53 +518,57 @@ class OrderManager:
                     # Partial close
                     pos.size -= trade.quantity
     
-    def _place_conditional_orders(
-        self, 
-        main_order: Order, 
-        stop_loss: Optional[float], 
-        take_profit: Optional[float]
-    ):
-        """Đặt SL/TP orders"""
-        try:
-            if not stop_loss and not take_profit:
-                return
-            
-            opposite_side = OrderSide.SELL if main_order.side == OrderSide.BUY else OrderSide.BUY
-            
-            # Stop Loss
-            if stop_loss:
-                sl_response = self._retry_api_call(
-                    self.session.place_order,
-                    category="linear",
-                    symbol=main_order.symbol,
-                    side=opposite_side.value,
-                    orderType="Market",
-                    qty=str(main_order.quantity),
-                    stopLoss=str(stop_loss),
-                    reduceOnly=True
-                )
-                
-                if sl_response and sl_response.get('retCode') == 0:
-                    self.logger.info(f"✅ Stop Loss placed @ ${stop_loss}")
-            
-            # Take Profit  
-            if take_profit:
-                tp_response = self._retry_api_call(
-                    self.session.place_order,
+    def _get_symbol_spec(self, symbol: str) -> SymbolSpec:
+        """Thông số lệnh của symbol (cache sau lần lấy thành công đầu tiên)"""
+        spec = self._specs.get(symbol)
+        if spec is not None:
+            return spec
+        
+        # Lần lấy trước bị lỗi -> dùng spec mặc định, không retry + backoff lại cho mỗi lệnh
+        fallback = self._fallback_specs.get(symbol)
+        if fallback is not None and time.monotonic() < fallback[0]:
+            return fallback[1]
+        
+        qty_step = tick_size = None
+        min_qty, max_qty = DEFAULT_MIN_QTY, DEFAULT_MAX_QTY
+        fetched = False
+        
+        if self.session is not None:
+            try:
+                response = self._retry_api_call(
+                    self.session.get_instruments_info,
                     category="linear",
-                    symbol=main_order.symbol,
-                    side=opposite_side.value,
-                    orderType="Market", 
-                    qty=str(main_order.quantity),
-                    takeProfit=str(take_profit),
-                    reduceOnly=True
+                    symbol=symbol
                 )
                 
-                if tp_response and tp_response.get('retCode') == 0:
-                    self.logger.info(f"✅ Take Profit placed @ ${take_profit}")
+                if response and response.get('retCode') == 0 and response['result']['list']:
+                    info = response['result']['list'][0]
+                    lot_filter = info['lotSizeFilter']
+                    qty_step = Decimal(lot_filter['qtyStep'])
+                    min_qty = lot_filter['minOrderQty']
+                    max_qty = lot_filter['maxOrderQty']
+                    tick_size = Decimal(info['priceFilter']['tickSize'])
+                    fetched = True
                     
-        except Exception as e:
-            self.logger.error(f"Lỗi place conditional orders: {e}")
+            except Exception as e:
+                self.logger.warning(f"Không lấy được instruments info {symbol}: {e}")
+        
+        spec = SymbolSpec(
+            symbol=symbol,
+            qty_step=qty_step,
+            tick_size=tick_size,
+            min_qty=Decimal(min_qty),
+            max_qty=Decimal(max_qty)
+        )
+        
+        # Spec từ API cache luôn; spec mặc định chỉ giữ SPEC_RETRY_INTERVAL rồi thử lại
+        if fetched:
+            self._specs[symbol] = spec
+            self._fallback_specs.pop(symbol, None)
+        else:
+            self._fallback_specs[symbol] = (time.monotonic() + SPEC_RETRY_INTERVAL, spec)
+        
+        return spec
     
     def _update_order_status(self, order: Order):
         """Cập nhật order status từ API"""
@@ -475,22 +584,24 @@ class OrderManager:
                 orders_data = response['result']['list']
                 
                 if orders_data:
-                    order_data = orders_data[0]
-                    order.status = OrderStatus(order_data['orderStatus'])
-                    order.filled_quantity = float(order_data.get('cumExecQty', 0))
-                    
-                    if order.filled_quantity > 0:
-                        order.avg_fill_price = float(order_data.get('avgPrice', 0))
-                    
-                    # Move to completed if filled or cancelled
-                    if order.status in [OrderStatus.FILLED, OrderStatus.CANCELLED]:
-                        self.completed_orders[order.order_id] = order
-                        if order.order_id in self.active_orders:
-                            del self.active_orders[order.order_id]
+                    self._apply_order_update(order, orders_data[0])
                 
         except Exception as e:
             self.logger.error(f"Lỗi update order status: {e}")
     
+    def _apply_order_update(self, order: Order, order_data: Dict):
+        """Áp dụng dữ liệu order (REST hoặc WebSocket) vào Order object"""
+        with self._order_lock:
+            order.status = _STATUS_BY_VALUE.get(order_data.get('orderStatus'), order.status)
+            order.filled_quantity = float(order_data.get('cumExecQty') or 0)
+            
+            if order.filled_quantity > 0:
+                order.avg_fill_price = float(order_data.get('avgPrice') or 0)
+            
+            # Move to completed if filled, cancelled or rejected
+            if order.status in _DONE_STATUSES:
+                self._untrack(order)
+    
     def _validate_order_params(
         self, 
         symbol: str, 
@@ -503,8 +614,9 @@ class OrderManager:
         if not symbol or quantity <= 0:
             return False
         
-        if quantity < 0.001:  # Min BTC size
-            self.logger.warning(f"Quantity quá nhỏ: {quantity}")
+        # Min/max theo instruments info của symbol (mặc định min 0.001 như BTC)
+        if not self._get_symbol_spec(symbol).is_valid_qty(quantity):
+            self.logger.warning(f"Quantity ngoài giới hạn của {symbol}: {quantity}")
             return False
         
         if price and price <= 0:
@@ -513,19 +625,17 @@ class OrderManager:
         return True
     
     def _retry_api_call(self, func, max_retries: int = 3, **kwargs):
-        """Retry API call"""
+        """Retry API call với exponential backoff + jitter"""
         for attempt in range(max_retries):
             try:
-                if attempt > 0:
-                    time.sleep(2 ** attempt)
-                
-                result = func(**kwargs)
-                return result
+                return func(**kwargs)
                 
             except Exception as e:
                 self.logger.warning(f"API call attempt {attempt + 1} failed: {e}")
                 if attempt == max_retries - 1:
                     raise
+                
+                time.sleep(backoff_delay(attempt))
         
         return None
     
@@ -1,14 +1,22 @@
 """
 Risk Manager - Quản lý rủi ro và position sizing
 """
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import math
+import numpy as np
 
-from ..models import TradingSignal, AccountInfo, Position, OrderSide
+from ..models import TradingSignal, SignalType, AccountInfo, Position, OrderSide
 from ..monitoring.logger import TradingLogger
 
 
+# Risk ước lượng cho mỗi position đang mở (% giá trị position)
+POSITION_RISK_PCT = 0.02
+
+# Hướng của signal: +1 LONG, -1 SHORT (risk = dir * (entry - sl), reward = dir * (tp - entry))
+SIGNAL_DIRECTION = {SignalType.LONG: 1.0, SignalType.SHORT: -1.0}
+
+
 @dataclass
 class RiskConfig:
     """Cấu hình risk management"""
@@ -66,8 +74,9 @@ class RiskManager:
         self.config = config or RiskConfig()
         self.logger = TradingLogger("RiskManager")
         
-        # Risk tracking
-        self.trade_history = []
+        # Risk tracking - PnL các trade gần nhất (ring buffer kelly_lookback phần tử)
+        self._pnl = np.zeros(self.config.kelly_lookback, dtype=np.float64)
+        self._pnl_count = 0
         self.peak_balance = 0.0
         self.current_drawdown = 0.0
         
@@ -101,11 +110,8 @@ class RiskManager:
             entry_price = signal.entry_price
             stop_loss = signal.stop_loss
             
-            # Calculate risk per unit
-            if signal.signal_type.value == "LONG":
-                risk_per_unit = abs(entry_price - stop_loss)
-            else:  # SHORT
-                risk_per_unit = abs(stop_loss - entry_price)
+            # Calculate risk per unit (hướng SL đã được kiểm tra trong _validate_signal)
+            risk_per_unit = abs(entry_price - stop_loss)
             
             if risk_per_unit <= 0:
                 return 0.0, {"error": "Invalid stop loss"}
@@ -202,15 +208,9 @@ class RiskManager:
             current_risk = self._calculate_portfolio_risk(account_info)
             available_risk = self.config.max_total_risk - current_risk
             
-            # Position metrics
+            # Position metrics - cùng một lần duyệt positions với portfolio risk
             position_count = len(account_info.positions)
-            total_exposure = sum(
-                pos.size * pos.current_price for pos in account_info.positions
-            )
-            
-            largest_position = max(
-                [pos.size * pos.current_price for pos in account_info.positions] + [0]
-            )
+            total_exposure, largest_position = self._position_exposure(account_info.positions)
             largest_position_pct = (largest_position / total_balance) * 100 if total_balance > 0 else 0
             
             # Drawdown
@@ -247,21 +247,21 @@ class RiskManager:
         risk_per_unit: float
     ) -> float:
         """Tính position size theo Kelly Criterion"""
-        if len(self.trade_history) < self.config.kelly_lookback:
+        if self._pnl_count < self.config.kelly_lookback:
             # Fallback to fixed risk
             return self._calculate_fixed_risk_size(balance, entry_price, risk_per_unit)
         
-        # Calculate Kelly fraction
-        recent_trades = self.trade_history[-self.config.kelly_lookback:]
-        wins = [t for t in recent_trades if t['pnl'] > 0]
-        losses = [t for t in recent_trades if t['pnl'] < 0]
+        # Calculate Kelly fraction - buffer đầy nên chứa đúng kelly_lookback trades gần nhất
+        recent_pnl = self._pnl
+        wins = recent_pnl > 0
+        losses = recent_pnl < 0
         
-        if not wins or not losses:
+        if not wins.any() or not losses.any():
             return self._calculate_fixed_risk_size(balance, entry_price, risk_per_unit)
         
-        win_rate = len(wins) / len(recent_trades)
-        avg_win = sum(t['pnl'] for t in wins) / len(wins)
-        avg_loss = abs(sum(t['pnl'] for t in losses) / len(losses))
+        win_rate = wins.mean()
+        avg_win = recent_pnl[wins].mean()
+        avg_loss = -recent_pnl[losses].mean()
         
         # Kelly formula: f = (bp - q) / b
         # where b = avg_win/avg_loss, p = win_rate, q = 1-win_rate
@@ -307,11 +307,9 @@ class RiskManager:
         if not signal.stop_loss or signal.stop_loss <= 0:
             return False
         
-        # Check SL direction
-        if signal.signal_type.value == "LONG" and signal.stop_loss >= signal.entry_price:
-            return False
-        
-        if signal.signal_type.value == "SHORT" and signal.stop_loss <= signal.entry_price:
+        # Check SL direction: SL phải nằm phía lỗ của entry
+        direction = SIGNAL_DIRECTION.get(signal.signal_type)
+        if direction is not None and direction * (signal.entry_price - signal.stop_loss) <= 0:
             return False
         
         return True
@@ -333,27 +331,33 @@ class RiskManager:
         sl = signal.stop_loss
         tp = signal.take_profit
         
-        if signal.signal_type.value == "LONG":
-            risk = entry - sl
-            reward = tp - entry
-        else:
-            risk = sl - entry
-            reward = entry - tp
+        direction = SIGNAL_DIRECTION.get(signal.signal_type, -1.0)
+        risk = direction * (entry - sl)
+        reward = direction * (tp - entry)
         
         return reward / risk if risk > 0 else 0.0
     
     def _calculate_portfolio_risk(self, account_info: AccountInfo, additional_risk: float = 0) -> float:
         """Tính tổng risk của portfolio"""
-        total_risk = additional_risk
+        total_exposure, _ = self._position_exposure(account_info.positions)
         
-        for pos in account_info.positions:
-            # Estimate risk based on position size (simplified)
-            position_value = pos.size * pos.current_price
-            estimated_risk = position_value * 0.02  # Assume 2% risk per position
-            total_risk += estimated_risk
+        # Estimate risk based on position size (simplified)
+        total_risk = additional_risk + total_exposure * POSITION_RISK_PCT
         
         return (total_risk / account_info.total_balance) * 100 if account_info.total_balance > 0 else 0
     
+    def _position_exposure(self, positions: List[Position]) -> Tuple[float, float]:
+        """Tổng giá trị và position lớn nhất trong một lần duyệt"""
+        total_exposure = 0.0
+        largest = 0.0
+        for pos in positions:
+            value = pos.size * pos.current_price
+            total_exposure += value
+            if value > largest:
+                largest = value
+        
+        return total_exposure, largest
+    
     def _calculate_current_drawdown(self, account_info: AccountInfo) -> float:
         """Tính drawdown hiện tại"""
         if account_info.total_balance > self.peak_balance:
@@ -387,12 +391,6 @@ class RiskManager:
     
     def add_trade_result(self, pnl: float, trade_info: Dict):
         """Thêm kết quả trade để tính Kelly"""
-        self.trade_history.append({
-            'pnl': pnl,
-            'timestamp': trade_info.get('timestamp'),
-            'symbol': trade_info.get('symbol'),
-        })
-        
-        # Giữ lại history limit
-        if len(self.trade_history) > self.config.kelly_lookback * 2:
-            self.trade_history = self.trade_history[-self.config.kelly_lookback:]
\ No newline at end of file
+        # Ghi đè trade cũ nhất - chỉ Kelly dùng history này
+        self._pnl[self._pnl_count % len(self._pnl)] = pnl
+        self._pnl_count += 1
\ No newline at end of file
@@ -2,9 +2,11 @@
 Base Strategy Class - Abstract base cho tất cả trading strategies
 """
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from numpy.lib.stride_tricks import sliding_window_view
 
 from ..models import TradingSignal, MarketData, Candle
 from ..monitoring.logger import TradingLogger
@@ -190,12 +192,24 @@ class BaseStrategy(ABC):
             return None
     
     def calculate_rsi(self, prices: pd.Series, period: int = 14) -> pd.Series:
-        """Tính RSI indicator"""
-        delta = prices.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-        rs = gain / loss
-        return 100 - (100 / (1 + rs))
+        """Tính RSI indicator (trung bình gain/loss đơn giản trên `period` nến)"""
+        values = prices.to_numpy(dtype=np.float64)
+        rsi = np.full(len(values), np.nan)
+        
+        if len(values) >= period:
+            # Nến đầu tiên không có delta -> tính là 0 (giống delta.where(...) của pandas)
+            delta = np.diff(values, prepend=values[:1])
+            gain = np.where(delta > 0, delta, 0.0)
+            loss = np.where(delta < 0, -delta, 0.0)
+            
+            # Tổng theo cửa sổ tính trực tiếp - không trôi số như cumsum
+            avg_gain = sliding_window_view(gain, period).sum(axis=1) / period
+            avg_loss = sliding_window_view(loss, period).sum(axis=1) / period
+            
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rsi[period - 1:] = 100 - (100 / (1 + avg_gain / avg_loss))
+        
+        return pd.Series(rsi, index=prices.index)
     
     def calculate_sma(self, prices: pd.Series, period: int) -> pd.Series:
         """Tính Simple Moving Average"""
@@ -205,14 +219,39 @@ class BaseStrategy(ABC):
         """Tính Exponential Moving Average"""
         return prices.ewm(span=period).mean()
     
+    @staticmethod
+    def _find_swing_points(highs: np.ndarray, lows: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tìm swing highs/lows bằng cửa sổ căn giữa (giống rolling(center=True))
+        
+        Returns:
+            (swing_high_mask, swing_low_mask) - mảng bool cùng độ dài với input
+        """
+        swing_high_mask = np.zeros(len(highs), dtype=bool)
+        swing_low_mask = np.zeros(len(lows), dtype=bool)
+        
+        if len(highs) < window:
+            return swing_high_mask, swing_low_mask
+        
+        offset = window // 2
+        high_windows = sliding_window_view(highs, window)
+        low_windows = sliding_window_view(lows, window)
+        
+        centered = slice(offset, offset + len(high_windows))
+        swing_high_mask[centered] = high_windows.max(axis=1) == highs[centered]
+        swing_low_mask[centered] = low_windows.min(axis=1) == lows[centered]
+        
+        return swing_high_mask, swing_low_mask
+    
     def detect_support_resistance(self, df: pd.DataFrame, window: int = 5) -> Dict:
         """Tìm support/resistance levels"""
-        # Simple implementation
-        highs = df['high'].rolling(window=window, center=True).max() == df['high']
-        lows = df['low'].rolling(window=window, center=True).min() == df['low']
+        # Simple implementation - đỉnh/đáy cục bộ trong cửa sổ căn giữa
+        highs = df['high'].to_numpy(dtype=np.float64)
+        lows = df['low'].to_numpy(dtype=np.float64)
+        high_mask, low_mask = self._find_swing_points(highs, lows, window)
         
-        resistance_levels = df.loc[highs, 'high'].dropna().tail(3).tolist()
-        support_levels = df.loc[lows, 'low'].dropna().tail(3).tolist()
+        resistance_levels = highs[high_mask][-3:].tolist()
+        support_levels = lows[low_mask][-3:].tolist()
         
         return {
             'resistance': resistance_levels,
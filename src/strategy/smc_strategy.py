@@ -7,7 +7,7 @@ import numpy as np
 from datetime import datetime
 
 from .base_strategy import BaseStrategy
-from ..models import TradingSignal, SignalType, MarketData, MarketStructure, OrderBlock, FairValueGap
+from ..models import TradingSignal, SignalType, MarketData, MarketStructure, OrderBlock, FairValueGap, CandleArray
 from ..monitoring.logger import TradingLogger
 
 
@@ -53,6 +53,15 @@ class SMCStrategy(BaseStrategy):
         self.rsi_values: pd.Series = pd.Series()
         self.sma_short: pd.Series = pd.Series()
         self.sma_long: pd.Series = pd.Series()
+        
+        # Giá trị indicator của nến cuối (scalar) cho factor/signal
+        self.latest_rsi: Optional[float] = None
+        self.latest_sma_short: Optional[float] = None
+        self.latest_sma_long: Optional[float] = None
+        
+        # Nến dạng cột (SoA) dùng chung cho structure/OB/FVG detection
+        self.candles: Optional[CandleArray] = None
+        self.candle_body: np.ndarray = np.empty(0)  # close - open
     
     def update_data(self, candles: pd.DataFrame, market_data: MarketData):
         """Cập nhật dữ liệu và tính toán indicators"""
@@ -65,6 +74,7 @@ class SMCStrategy(BaseStrategy):
         
         # Tính indicators
         self._calculate_indicators()
+        self._load_arrays()
         
         # SMC Analysis
         self._analyze_market_structure()
@@ -77,7 +87,7 @@ class SMCStrategy(BaseStrategy):
             return None
         
         current_price = self.market_data.current_price
-        current_rsi = self.rsi_values.iloc[-1] if not self.rsi_values.empty else 50
+        current_rsi = self.latest_rsi if self.latest_rsi is not None else 50
         
         # Confluence factors
         structure_factor = self._get_structure_factor()
@@ -132,27 +142,35 @@ class SMCStrategy(BaseStrategy):
         # Moving Averages
         self.sma_short = self.calculate_sma(closes, self.config['sma_short'])
         self.sma_long = self.calculate_sma(closes, self.config['sma_long'])
+        
+        # Đọc giá trị cuối một lần, các bước sau so sánh scalar trực tiếp
+        self.latest_rsi = float(self.rsi_values.to_numpy()[-1])
+        self.latest_sma_short = float(self.sma_short.to_numpy()[-1])
+        self.latest_sma_long = float(self.sma_long.to_numpy()[-1])
+    
+    def _load_arrays(self):
+        """Tách các cột sang NumPy một lần cho mỗi lần update"""
+        self.candles = CandleArray.from_df(self.candle_data)
+        self.candle_body = self.candles.close - self.candles.open
     
     def _analyze_market_structure(self):
         """Phân tích cấu trúc thị trường - BOS/CHoCH detection"""
         if len(self.candle_data) < self.config['swing_window'] * 2:
             return
         
-        df = self.candle_data.copy()
-        window = self.config['swing_window']
+        highs = self.candles.high
+        lows = self.candles.low
         
         # Tìm swing highs và lows
-        highs_condition = df['high'].rolling(window=window, center=True).max() == df['high']
-        lows_condition = df['low'].rolling(window=window, center=True).min() == df['low']
-        
-        swing_highs = df.loc[highs_condition, 'high'].dropna()
-        swing_lows = df.loc[lows_condition, 'low'].dropna()
+        swing_high_mask, swing_low_mask = self._find_swing_points(highs, lows, self.config['swing_window'])
+        swing_highs = highs[swing_high_mask]
+        swing_lows = lows[swing_low_mask]
         
         if len(swing_highs) >= 2 and len(swing_lows) >= 2:
-            latest_high = swing_highs.iloc[-1]
-            prev_high = swing_highs.iloc[-2]
-            latest_low = swing_lows.iloc[-1]
-            prev_low = swing_lows.iloc[-2]
+            latest_high = swing_highs[-1]
+            prev_high = swing_highs[-2]
+            latest_low = swing_lows[-1]
+            prev_low = swing_lows[-2]
             
             # BOS Logic
             if latest_high > prev_high and latest_low > prev_low:
@@ -169,54 +187,40 @@ class SMCStrategy(BaseStrategy):
         if len(self.candle_data) < 10:
             return
         
-        df = self.candle_data.copy()
         multiplier = self.config['ob_strength_multiplier']
         
-        for i in range(5, len(df) - 5):
-            candle = df.iloc[i]
-            
-            # Bullish Order Block
-            if candle['close'] > candle['open']:  # Green candle
-                candle_size = candle['close'] - candle['open']
-                avg_size = df.iloc[i-5:i]['close'].subtract(df.iloc[i-5:i]['open']).abs().std()
-                
-                if candle_size > avg_size * multiplier:
-                    # Check impulse move after
-                    future_high = df.iloc[i+1:i+6]['high'].max()
-                    if future_high > candle['high'] * 1.01:  # 1% impulse
-                        
-                        ob = OrderBlock(
-                            type='BULLISH_OB',
-                            high=candle['high'],
-                            low=candle['low'],
-                            timestamp=df.iloc[i]['timestamp'] if 'timestamp' in df.columns else datetime.now(),
-                            volume=candle.get('volume', 0),
-                            confidence=min(candle_size / (avg_size * multiplier), 1.0) * 100
-                        )
-                        self.order_blocks.append(ob)
+        highs = self.candles.high
+        lows = self.candles.low
+        
+        window_view = np.lib.stride_tricks.sliding_window_view
+        body = self.candle_body
+        candle_size = np.abs(body)
+        
+        # Nến i: độ lệch chuẩn thân 5 nến trước và high/low 5 nến sau
+        idx = np.arange(5, len(highs) - 5)
+        avg_size = window_view(candle_size, 5).std(axis=1, ddof=1)[idx - 5]
+        future_high = window_view(highs, 5).max(axis=1)[idx + 1]
+        future_low = window_view(lows, 5).min(axis=1)[idx + 1]
+        
+        # Ngưỡng nến mạnh tính một lần, dùng cho cả mask và confidence
+        threshold = avg_size * multiplier
+        strong = candle_size[idx] > threshold
+        bullish = strong & (body[idx] > 0) & (future_high > highs[idx] * 1.01)  # 1% impulse
+        bearish = strong & (body[idx] < 0) & (future_low < lows[idx] * 0.99)  # 1% impulse
+        
+        # Giữ lại 3 OB gần nhất - chỉ dựng object cho các nến đó
+        for j in np.flatnonzero(bullish | bearish)[-3:]:
+            i = idx[j]
             
-            # Bearish Order Block  
-            elif candle['close'] < candle['open']:  # Red candle
-                candle_size = candle['open'] - candle['close']
-                avg_size = df.iloc[i-5:i]['open'].subtract(df.iloc[i-5:i]['close']).abs().std()
-                
-                if candle_size > avg_size * multiplier:
-                    # Check impulse move after
-                    future_low = df.iloc[i+1:i+6]['low'].min()
-                    if future_low < candle['low'] * 0.99:  # 1% impulse
-                        
-                        ob = OrderBlock(
-                            type='BEARISH_OB',
-                            high=candle['high'],
-                            low=candle['low'],
-                            timestamp=df.iloc[i]['timestamp'] if 'timestamp' in df.columns else datetime.now(),
-                            volume=candle.get('volume', 0),
-                            confidence=min(candle_size / (avg_size * multiplier), 1.0) * 100
-                        )
-                        self.order_blocks.append(ob)
-        
-        # Giữ lại 3 OB gần nhất
-        self.order_blocks = self.order_blocks[-3:]
+            ob = OrderBlock(
+                type='BULLISH_OB' if bullish[j] else 'BEARISH_OB',
+                high=highs[i],
+                low=lows[i],
+                timestamp=self._candle_time(i),
+                volume=self.candles.volume[i],
+                confidence=min(candle_size[i] / threshold[j], 1.0) * 100
+            )
+            self.order_blocks.append(ob)
     
     def _detect_fair_value_gaps(self):
         """Phát hiện Fair Value Gaps"""
@@ -225,39 +229,40 @@ class SMCStrategy(BaseStrategy):
         if len(self.candle_data) < 3:
             return
         
-        df = self.candle_data.copy()
+        highs = self.candles.high
+        lows = self.candles.low
+        body = self.candle_body[1:-1]
+        
+        # So sánh nến i-1 với nến i+1 cho mọi i cùng lúc
+        bullish = (lows[:-2] > highs[2:]) & (body > 0)
+        bearish = (highs[:-2] < lows[2:]) & (body < 0)
         
-        for i in range(1, len(df) - 1):
-            candle_before = df.iloc[i-1]
-            candle_current = df.iloc[i]
-            candle_after = df.iloc[i+1]
+        # Giữ lại 2 FVG gần nhất - chỉ dựng object cho các nến đó
+        for j in np.flatnonzero(bullish | bearish)[-2:]:
+            i = j + 1
+            timestamp = self._candle_time(i)
             
-            # Bullish FVG
-            if (candle_before['low'] > candle_after['high'] and
-                candle_current['close'] > candle_current['open']):
-                
+            if bullish[j]:
                 fvg = FairValueGap(
                     type='BULLISH_FVG',
-                    high=candle_before['low'],
-                    low=candle_after['high'],
-                    timestamp=df.iloc[i]['timestamp'] if 'timestamp' in df.columns else datetime.now()
+                    high=lows[i-1],
+                    low=highs[i+1],
+                    timestamp=timestamp
                 )
-                self.fair_value_gaps.append(fvg)
-            
-            # Bearish FVG
-            elif (candle_before['high'] < candle_after['low'] and
-                  candle_current['close'] < candle_current['open']):
-                
+            else:
                 fvg = FairValueGap(
                     type='BEARISH_FVG',
-                    high=candle_after['low'],
-                    low=candle_before['high'],
-                    timestamp=df.iloc[i]['timestamp'] if 'timestamp' in df.columns else datetime.now()
+                    high=lows[i+1],
+                    low=highs[i-1],
+                    timestamp=timestamp
                 )
-                self.fair_value_gaps.append(fvg)
-        
-        # Giữ lại 2 FVG gần nhất
-        self.fair_value_gaps = self.fair_value_gaps[-2:]
+            self.fair_value_gaps.append(fvg)
+    
+    def _candle_time(self, i: int) -> datetime:
+        """Đổi timestamp nến i (epoch ms) sang datetime - chỉ khi dựng OB/FVG"""
+        if self.candles.timestamp is None:
+            return datetime.now()
+        return pd.Timestamp(int(self.candles.timestamp[i]), unit='ms')
     
     def _get_structure_factor(self) -> Dict[str, float]:
         """Đánh giá factor từ market structure"""
@@ -285,11 +290,11 @@ class SMCStrategy(BaseStrategy):
     
     def _get_trend_factor(self, current_price: float) -> Dict[str, float]:
         """Đánh giá factor từ trend (SMA)"""
-        if self.sma_short.empty or self.sma_long.empty:
+        if self.latest_sma_short is None or self.latest_sma_long is None:
             return {'bullish': 0.0, 'bearish': 0.0}
         
-        sma_short = self.sma_short.iloc[-1]
-        sma_long = self.sma_long.iloc[-1]
+        sma_short = self.latest_sma_short
+        sma_long = self.latest_sma_long
         
         if current_price > sma_short > sma_long:
             return {'bullish': 1.0, 'bearish': 0.0}
@@ -300,46 +305,42 @@ class SMCStrategy(BaseStrategy):
     
     def _get_order_block_factor(self, current_price: float) -> Dict[str, float]:
         """Đánh giá factor từ Order Blocks"""
-        bullish_obs = [ob for ob in self.order_blocks if ob.type == 'BULLISH_OB']
-        bearish_obs = [ob for ob in self.order_blocks if ob.type == 'BEARISH_OB']
-        
-        # Check if price near any OB
-        near_bullish = any(
-            ob.low <= current_price <= ob.high 
-            for ob in bullish_obs
-        )
-        
-        near_bearish = any(
-            ob.low <= current_price <= ob.high
-            for ob in bearish_obs
-        )
-        
-        if near_bullish and bullish_obs:
+        has_bullish = has_bearish = False
+        near_bullish = near_bearish = False
+        
+        # Một lượt duyệt: phân loại OB và kiểm tra giá nằm trong OB
+        for ob in self.order_blocks:
+            inside = ob.low <= current_price <= ob.high
+            if ob.type == 'BULLISH_OB':
+                has_bullish = True
+                near_bullish = near_bullish or inside
+            elif ob.type == 'BEARISH_OB':
+                has_bearish = True
+                near_bearish = near_bearish or inside
+        
+        if near_bullish:
             return {'bullish': 1.0, 'bearish': 0.0}
-        elif near_bearish and bearish_obs:
+        elif near_bearish:
             return {'bullish': 0.0, 'bearish': 1.0}
-        elif bullish_obs and not bearish_obs:
+        elif has_bullish and not has_bearish:
             return {'bullish': 0.5, 'bearish': 0.0}
-        elif bearish_obs and not bullish_obs:
+        elif has_bearish and not has_bullish:
             return {'bullish': 0.0, 'bearish': 0.5}
         else:
             return {'bullish': 0.0, 'bearish': 0.0}
     
     def _get_fvg_factor(self, current_price: float) -> Dict[str, float]:
         """Đánh giá factor từ Fair Value Gaps"""
-        if not self.fair_value_gaps:
-            return {'bullish': 0.0, 'bearish': 0.0}
+        in_bullish_fvg = in_bearish_fvg = False
         
-        # Check if price in any FVG
-        in_bullish_fvg = any(
-            fvg.low <= current_price <= fvg.high and fvg.type == 'BULLISH_FVG' and not fvg.filled
-            for fvg in self.fair_value_gaps
-        )
-        
-        in_bearish_fvg = any(
-            fvg.low <= current_price <= fvg.high and fvg.type == 'BEARISH_FVG' and not fvg.filled
-            for fvg in self.fair_value_gaps
-        )
+        # Check if price in any FVG - một lượt duyệt cho cả hai loại
+        for fvg in self.fair_value_gaps:
+            if fvg.filled or not (fvg.low <= current_price <= fvg.high):
+                continue
+            if fvg.type == 'BULLISH_FVG':
+                in_bullish_fvg = True
+            elif fvg.type == 'BEARISH_FVG':
+                in_bearish_fvg = True
         
         if in_bullish_fvg:
             return {'bullish': 1.0, 'bearish': 0.0}
@@ -358,7 +359,7 @@ class SMCStrategy(BaseStrategy):
             reason_parts.append("Bullish BOS")
         if any(ob.type == 'BULLISH_OB' for ob in self.order_blocks):
             reason_parts.append("Bullish OB")
-        if self.sma_short.iloc[-1] > self.sma_long.iloc[-1]:
+        if self.latest_sma_short > self.latest_sma_long:
             reason_parts.append("Uptrend")
         
         reason = " + ".join(reason_parts) if reason_parts else "SMC Confluence"
@@ -375,7 +376,7 @@ class SMCStrategy(BaseStrategy):
                 'market_structure': self.market_structure.value,
                 'order_blocks': len(self.order_blocks),
                 'fair_value_gaps': len(self.fair_value_gaps),
-                'rsi': self.rsi_values.iloc[-1] if not self.rsi_values.empty else None
+                'rsi': self.latest_rsi
             }
         )
     
@@ -389,7 +390,7 @@ class SMCStrategy(BaseStrategy):
             reason_parts.append("Bearish BOS")
         if any(ob.type == 'BEARISH_OB' for ob in self.order_blocks):
             reason_parts.append("Bearish OB")
-        if self.sma_short.iloc[-1] < self.sma_long.iloc[-1]:
+        if self.latest_sma_short < self.latest_sma_long:
             reason_parts.append("Downtrend")
         
         reason = " + ".join(reason_parts) if reason_parts else "SMC Confluence"
@@ -406,6 +407,6 @@ class SMCStrategy(BaseStrategy):
                 'market_structure': self.market_structure.value,
                 'order_blocks': len(self.order_blocks),
                 'fair_value_gaps': len(self.fair_value_gaps),
-                'rsi': self.rsi_values.iloc[-1] if not self.rsi_values.empty else None
+                'rsi': self.latest_rsi
             }
         )
\ No newline at end of file
@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from typing import Dict, Optional, List
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 
 from src.data_feed.market_data import MarketDataFeed
 from src.strategy.smc_strategy import SMCStrategy
@@ -14,7 +15,7 @@ from src.risk_management.risk_manager import RiskManager, RiskConfig
 from src.order_manager.order_manager import OrderManager
 from src.monitoring.logger import TradingLogger
 from src.monitoring.metrics import PerformanceMetrics
-from src.models import TradingMode, AccountInfo, TradingSignal
+from src.models import TradingMode, AccountInfo, TradingSignal, SignalType, OrderSide
 
 
 @dataclass
@@ -62,6 +63,9 @@ class TradingBotV2:
         self.daily_trades = 0
         self.daily_reset_time = datetime.now().date()
         
+        # Được set khi nến đóng (WebSocket) để main loop chạy ngay
+        self.candle_closed = threading.Event()
+        
         # Initialize modules
         self._initialize_modules()
         
@@ -125,12 +129,18 @@ class TradingBotV2:
         # Start data feed updates
         self.data_feed.start_real_time_updates([self.config.symbol])
         
+        # Nến đóng -> đánh thức main loop thay vì chờ hết update_interval
+        self.data_feed.add_candle_callback(self._on_candle_closed)
+        self.data_feed.start_kline_stream(self.config.symbol, self.strategy.get_timeframe())
+        
         self.logger.info("✅ Trading bot đã khởi động")
     
     def stop(self):
         """Dừng trading bot"""
         self.is_running = False
+        self.candle_closed.set()
         self.data_feed.stop_real_time_updates()
+        self.order_manager.stop_order_stream()
         
         if hasattr(self, 'main_thread'):
             self.main_thread.join()
@@ -152,13 +162,17 @@ class TradingBotV2:
                     continue
                 
                 # Get market data
+                self.candle_closed.clear()
                 candles = self.data_feed.get_candles(
                     self.config.symbol, 
                     self.strategy.get_timeframe(),
                     self.strategy.get_required_history()
                 )
                 
-                market_data = self.data_feed.get_market_data(self.config.symbol)
+                # Giá do ticker stream / update loop đẩy vào cache - chỉ gọi REST khi cache cũ
+                market_data = self.data_feed.get_market_data(
+                    self.config.symbol, max_age=self.config.update_interval
+                )
                 
                 if candles.empty or not market_data:
                     self.logger.warning("Không có dữ liệu thị trường")
@@ -174,12 +188,18 @@ class TradingBotV2:
                 # Log status periodically
                 self._log_status()
                 
-                time.sleep(self.config.update_interval)
+                # Chờ nến đóng, tối đa update_interval (polling dự phòng)
+                self.candle_closed.wait(self.config.update_interval)
                 
             except Exception as e:
                 self.logger.error(f"Lỗi trong main loop: {e}")
                 time.sleep(30)  # Wait before retry
     
+    def _on_candle_closed(self, symbol: str, candles):
+        """Callback từ data feed khi có nến mới đóng"""
+        if symbol == self.config.symbol:
+            self.candle_closed.set()
+    
     def _handle_trading_signal(self, signal: TradingSignal):
         """Xử lý trading signal"""
         try:
@@ -232,12 +252,10 @@ class TradingBotV2:
     def _execute_signal(self, signal: TradingSignal, position_size: float) -> bool:
         """Thực thi signal"""
         try:
-            from src.models import OrderSide
-            
             # Determine order side
-            if signal.signal_type.value == "LONG":
+            if signal.signal_type is SignalType.LONG:
                 side = OrderSide.BUY
-            elif signal.signal_type.value == "SHORT":
+            elif signal.signal_type is SignalType.SHORT:
                 side = OrderSide.SELL
             else:
                 return False
@@ -370,18 +388,40 @@ class TradingBotV2:
         return None
 
 
-def create_bot_from_env() -> TradingBotV2:
-    """Tạo bot từ environment variables"""
+@dataclass(frozen=True)
+class EnvSettings:
+    """Cấu hình đọc từ .env / environment variables"""
+    api_key: Optional[str]
+    api_secret: Optional[str]
+    symbol: str
+    auto_trade: bool
+
+
+@lru_cache(maxsize=1)
+def load_env_settings() -> EnvSettings:
+    """Đọc .env và parse environment một lần duy nhất cho cả process"""
     from dotenv import load_dotenv
     load_dotenv()
     
-    config = BotConfig(
+    return EnvSettings(
         api_key=os.getenv("API_KEY"),
         api_secret=os.getenv("API_SECRET"),
-        testnet=True,
         symbol=os.getenv("SYMBOL", "BTCUSDT"),
-        trading_mode=TradingMode.PAPER,  # Start with paper trading
         auto_trade=os.getenv("AUTO_TRADE", "false").lower() == "true"
     )
+
+
+def create_bot_from_env() -> TradingBotV2:
+    """Tạo bot từ environment variables"""
+    settings = load_env_settings()
+    
+    config = BotConfig(
+        api_key=settings.api_key,
+        api_secret=settings.api_secret,
+        testnet=True,
+        symbol=settings.symbol,
+        trading_mode=TradingMode.PAPER,  # Start with paper trading
+        auto_trade=settings.auto_trade
+    )
     
     return TradingBotV2(config)
\ No newline at end of file
@@ -5,7 +5,9 @@ from dotenv import load_dotenv
 from pybit.unified_trading import HTTP
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import NamedTuple, Optional
 
 print("=== 🤖 SMC Bot VPS Version ===")
 print(f"🕐 Singapore Time: {datetime.now()}")
@@ -46,19 +48,39 @@ def retry_api_call(func, *args, **kwargs):
 # ======================
 load_dotenv()
 
-API_KEY = os.getenv("API_KEY")
-API_SECRET = os.getenv("API_SECRET") 
-SYMBOL = os.getenv("SYMBOL", "BTCUSDT")
-LEVERAGE = int(os.getenv("LEVERAGE", 5))
-RISK_PERCENT = float(os.getenv("RISK_PERCENT", 1))
-AUTO_TRADE = os.getenv("AUTO_TRADE", "false").lower() == "true"
-POSITION_SIZE_USDT = float(os.getenv("POSITION_SIZE_USDT", "25"))
+class Config(NamedTuple):
+    """Cấu hình bot - parse một lần, không đổi trong suốt process"""
+    api_key: Optional[str]
+    api_secret: Optional[str]
+    symbol: str
+    leverage: int
+    risk_percent: float
+    auto_trade: bool
+    position_size_usdt: float
 
-print(f"📊 Symbol: {SYMBOL}")
-print(f"🤖 Auto Trade: {AUTO_TRADE}")
-print(f"💰 Position Size: ${POSITION_SIZE_USDT}")
+CFG = Config(
+    api_key=os.getenv("API_KEY"),
+    api_secret=os.getenv("API_SECRET"),
+    symbol=os.getenv("SYMBOL", "BTCUSDT"),
+    leverage=int(os.getenv("LEVERAGE", 5)),
+    risk_percent=float(os.getenv("RISK_PERCENT", 1)),
+    auto_trade=os.getenv("AUTO_TRADE", "false").lower() == "true",
+    position_size_usdt=float(os.getenv("POSITION_SIZE_USDT", "25")),
+)
 
-if not API_KEY or not API_SECRET:
+# Tỷ lệ risk mỗi lệnh (RISK_PERCENT / 100) - tính sẵn một lần
+RISK_FRACTION = CFG.risk_percent / 100
+
+# Bước khối lượng BTCUSDT là 0.001 -> qty được tính bằng số nguyên lot
+QTY_LOTS_PER_UNIT = 1000
+# tickSize BTCUSDT là 0.1 -> giá SL/TP gửi với 1 chữ số thập phân
+PRICE_DECIMALS = 1
+
+print(f"📊 Symbol: {CFG.symbol}")
+print(f"🤖 Auto Trade: {CFG.auto_trade}")
+print(f"💰 Position Size: ${CFG.position_size_usdt}")
+
+if not CFG.api_key or not CFG.api_secret:
     print("❌ Missing API credentials in .env file")
     exit(1)
 
@@ -66,7 +88,7 @@ if not API_KEY or not API_SECRET:
 # 2️⃣ Connect Bybit
 # ======================
 try:
-    session = HTTP(testnet=True, api_key=API_KEY, api_secret=API_SECRET)
+    session = HTTP(testnet=True, api_key=CFG.api_key, api_secret=CFG.api_secret)
     print("✅ Connected to Bybit Singapore successfully!")
 except Exception as e:
     print(f"❌ Bybit connection failed: {e}")
@@ -85,17 +107,26 @@ def calculate_rsi(prices, period=14):
 
 def detect_market_structure(df):
     """Detect BOS (Break of Structure) and CHoCH (Change of Character)"""
-    highs = df['high'].rolling(5, center=True).max() == df['high']
-    lows = df['low'].rolling(5, center=True).min() == df['low']
+    if len(df) < 5:
+        return "NEUTRAL"
     
-    swing_highs = df.loc[highs, 'high'].dropna()
-    swing_lows = df.loc[lows, 'low'].dropna()
+    highs = df['high'].to_numpy()
+    lows = df['low'].to_numpy()
+    
+    # Swing point: bằng max/min của cửa sổ 5 nến căn giữa (mask np.bool_)
+    centre_highs = highs[2:-2]
+    centre_lows = lows[2:-2]
+    high_mask = np.lib.stride_tricks.sliding_window_view(highs, 5).max(axis=1) == centre_highs
+    low_mask = np.lib.stride_tricks.sliding_window_view(lows, 5).min(axis=1) == centre_lows
+    
+    swing_highs = centre_highs[high_mask]
+    swing_lows = centre_lows[low_mask]
     
     if len(swing_highs) >= 2 and len(swing_lows) >= 2:
-        latest_high = swing_highs.iloc[-1]
-        prev_high = swing_highs.iloc[-2]
-        latest_low = swing_lows.iloc[-1] 
-        prev_low = swing_lows.iloc[-2]
+        latest_high = swing_highs[-1]
+        prev_high = swing_highs[-2]
+        latest_low = swing_lows[-1] 
+        prev_low = swing_lows[-2]
         
         # BOS Bullish: New higher high
         if latest_high > prev_high:
@@ -170,51 +201,64 @@ def detect_fair_value_gaps(df):
     
     return fvgs[-2:] if fvgs else []  # Return latest 2
 
-def get_smc_signal():
-    """Main SMC analysis function"""
+def fetch_candles():
+    """Lấy 100 nến 15m gần nhất"""
+    return retry_api_call(
+        session.get_kline,
+        category="linear",
+        symbol=CFG.symbol,
+        interval="15",
+        limit=100
+    )
+
+def get_smc_signal(candles_future=None):
+    """Main SMC analysis function
+
+    candles_future: Future của fetch_candles() đã chạy song song (optional)
+    """
     try:
         print("🔍 Starting SMC analysis...")
         
         # Get market data
-        candles = retry_api_call(
-            session.get_kline,
-            category="linear",
-            symbol=SYMBOL,
-            interval="15",
-            limit=100
-        )
+        candles = candles_future.result() if candles_future else fetch_candles()
         
         if not candles:
             print("❌ Failed to get market data")
             return None
             
-        # Convert to DataFrame
-        df = pd.DataFrame(candles['result']['list'], columns=[
-            'timestamp', 'open', 'high', 'low', 'close', 'volume', 'turnover'
-        ])
-        
-        for col in ['open', 'high', 'low', 'close']:
-            df[col] = df[col].astype(float)
-        
-        df = df.sort_values('timestamp').reset_index(drop=True)
-        
-        # Calculate indicators
-        df['sma_20'] = df['close'].rolling(20).mean()
-        df['sma_50'] = df['close'].rolling(50).mean() 
-        df['rsi'] = calculate_rsi(df['close'], 14)
+        # Convert to DataFrame - parse cả khối OHLC trong một lần cast
+        raw = np.asarray(candles['result']['list'])
+        timestamps = raw[:, 0].astype(np.int64)
+        order = np.argsort(timestamps)
+        
+        df = pd.DataFrame(
+            raw[order, 1:5].astype(np.float64),
+            columns=['open', 'high', 'low', 'close']
+        )
+        df['timestamp'] = timestamps[order]
         
-        current_price = df['close'].iloc[-1]
-        current_rsi = df['rsi'].iloc[-1]
+        # Calculate indicators - chỉ cần giá trị SMA20 cuối cùng
+        closes = df['close'].to_numpy()
+        sma_20 = closes[-20:].mean() if len(closes) >= 20 else np.nan
+        rsi = calculate_rsi(df['close'], 14).to_numpy()
+
+        current_price = float(closes[-1])
+        current_rsi = float(rsi[-1])
         
         print(f"📈 Current Price: ${current_price:,.2f}")
         print(f"📊 RSI: {current_rsi:.1f}")
         
         # SMC Analysis
         market_structure = detect_market_structure(df)
+        print(f"🏗️ Market Structure: {market_structure}")
+        
+        # Cả LONG và SHORT đều cần BOS -> NEUTRAL thì bỏ qua quét OB/FVG
+        if market_structure == "NEUTRAL":
+            return None
+        
         order_blocks = detect_order_blocks(df)
         fvgs = detect_fair_value_gaps(df)
         
-        print(f"🏗️ Market Structure: {market_structure}")
         print(f"📦 Order Blocks: {len(order_blocks)} detected")
         print(f"📊 Fair Value Gaps: {len(fvgs)} detected")
         
@@ -224,7 +268,7 @@ def get_smc_signal():
         # LONG Signal Conditions
         if (market_structure == "BULLISH_BOS" and
             current_rsi < 70 and  # Not overbought
-            current_price > df['sma_20'].iloc[-1] and
+            current_price > sma_20 and
             any(ob['type'] == 'BULLISH_OB' for ob in order_blocks)):
             
             signal = {
@@ -239,7 +283,7 @@ def get_smc_signal():
         # SHORT Signal Conditions  
         elif (market_structure == "BEARISH_BOS" and
               current_rsi > 30 and  # Not oversold
-              current_price < df['sma_20'].iloc[-1] and
+              current_price < sma_20 and
               any(ob['type'] == 'BEARISH_OB' for ob in order_blocks)):
             
             signal = {
@@ -257,64 +301,86 @@ def get_smc_signal():
         print(f"❌ SMC analysis error: {e}")
         return None
 
+def format_qty(lots):
+    """Format số lot (bội của 0.001) thành chuỗi qty chính xác cho Bybit"""
+    units, frac = divmod(lots, QTY_LOTS_PER_UNIT)
+    return f"{units}.{frac:03d}"
+
+def format_price(price):
+    """Format giá theo tickSize BTCUSDT (tránh chuỗi như 64148.27500000001 bị reject)"""
+    return f"{price:.{PRICE_DECIMALS}f}"
+
 def calculate_position_size(signal, available_balance):
-    """Calculate position size based on risk management"""
+    """Calculate position size based on risk management
+
+    Returns:
+        Số lot nguyên (1 lot = 0.001 BTC)
+    """
     try:
         current_price = signal['entry_price']
         stop_loss = signal['stop_loss']
         
-        # Calculate risk per unit
-        if signal['direction'] == 'LONG':
-            risk_per_unit = current_price - stop_loss
-        else:
-            risk_per_unit = stop_loss - current_price
+        # Calculate risk per unit (LONG: +1, SHORT: -1)
+        sign = 1.0 if signal['direction'] == 'LONG' else -1.0
+        risk_per_unit = sign * (current_price - stop_loss)
             
         # Calculate position size based on risk
-        risk_amount = available_balance * (RISK_PERCENT / 100)  # 1% risk
-        position_size = min(risk_amount / risk_per_unit, POSITION_SIZE_USDT / current_price)
+        risk_amount = available_balance * RISK_FRACTION  # 1% risk
+        position_size = min(risk_amount / risk_per_unit, CFG.position_size_usdt / current_price)
         
-        # Round to appropriate precision for BTCUSDT
-        position_size = round(position_size, 3)
+        # Round to appropriate precision for BTCUSDT (số nguyên lot)
+        lots = max(round(position_size * QTY_LOTS_PER_UNIT), 1)  # Minimum 0.001 BTC
         
         print(f"💰 Risk Amount: ${risk_amount:.2f}")
-        print(f"📏 Position Size: {position_size} BTC")
+        print(f"📏 Position Size: {format_qty(lots)} BTC")
         
-        return position_size if position_size >= 0.001 else 0.001  # Minimum 0.001 BTC
+        return lots
         
     except Exception as e:
         print(f"❌ Position size calculation error: {e}")
-        return 0.001
+        return 1
 
-def place_market_order(signal):
-    """Place market order with stop loss and take profit"""
+def place_market_order(signal, available_balance=None):
+    """Place market order with stop loss and take profit
+
+    available_balance: balance đã lấy trong check_account_status (bỏ qua REST call)
+    """
     try:
         print(f"🚀 Placing {signal['direction']} market order...")
         
         # Get current balance
-        balance_data = retry_api_call(session.get_wallet_balance, accountType="UNIFIED")
-        if not balance_data:
-            print("❌ Cannot get balance for order placement")
-            return None
-            
-        available_balance = float(balance_data['result']['list'][0].get('totalAvailableBalance', 0))
+        if available_balance is None:
+            balance_data = retry_api_call(session.get_wallet_balance, accountType="UNIFIED")
+            if not balance_data:
+                print("❌ Cannot get balance for order placement")
+                return None
+                
+            available_balance = float(balance_data['result']['list'][0].get('totalAvailableBalance', 0))
         
         # Calculate position size
-        qty = calculate_position_size(signal, available_balance)
+        lots = calculate_position_size(signal, available_balance)
         
-        if qty < 0.001:
+        if lots < 1:
             print("❌ Position size too small or insufficient balance")
             return None
         
-        # Place main market order
+        qty = format_qty(lots)
+        
+        # Place market order - SL/TP gắn luôn vào lệnh vào (1 request duy nhất)
         side = "Buy" if signal['direction'] == 'LONG' else "Sell"
         
         order_result = retry_api_call(
             session.place_order,
             category="linear",
-            symbol=SYMBOL,
+            symbol=CFG.symbol,
             side=side,
             orderType="Market",
-            qty=str(qty),
+            qty=qty,
+            stopLoss=format_price(signal['stop_loss']),
+            takeProfit=format_price(signal['take_profit']),
+            tpslMode="Full",
+            slTriggerBy="LastPrice",
+            tpTriggerBy="LastPrice",
             reduceOnly=False
         )
         
@@ -324,45 +390,9 @@ def place_market_order(signal):
             
         order_id = order_result['result']['orderId']
         print(f"✅ Market order placed! ID: {order_id}")
+        print(f"✅ Stop Loss set at ${signal['stop_loss']:.2f}")
+        print(f"✅ Take Profit set at ${signal['take_profit']:.2f}")
         
-        # Wait a moment for order to execute
-        time.sleep(2)
-        
-        # Place Stop Loss order
-        sl_side = "Sell" if signal['direction'] == 'LONG' else "Buy"
-        sl_result = retry_api_call(
-            session.place_order,
-            category="linear", 
-            symbol=SYMBOL,
-            side=sl_side,
-            orderType="Market",
-            qty=str(qty),
-            stopLoss=str(signal['stop_loss']),
-            reduceOnly=True
-        )
-        
-        if sl_result and sl_result.get('retCode') == 0:
-            print(f"✅ Stop Loss placed at ${signal['stop_loss']:.2f}")
-        else:
-            print(f"⚠️ Stop Loss failed: {sl_result}")
-        
-        # Place Take Profit order  
-        tp_result = retry_api_call(
-            session.place_order,
-            category="linear",
-            symbol=SYMBOL, 
-            side=sl_side,
-            orderType="Market",
-            qty=str(qty),
-            takeProfit=str(signal['take_profit']),
-            reduceOnly=True
-        )
-        
-        if tp_result and tp_result.get('retCode') == 0:
-            print(f"✅ Take Profit placed at ${signal['take_profit']:.2f}")
-        else:
-            print(f"⚠️ Take Profit failed: {tp_result}")
-            
         return order_id
         
     except Exception as e:
@@ -374,11 +404,16 @@ def check_account_status():
     try:
         print("💰 Checking account...")
         
-        # Get balance with retry
-        balance_data = retry_api_call(
-            session.get_wallet_balance,
-            accountType="UNIFIED"
-        )
+        # Balance và positions độc lập nhau -> gọi song song
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            balance_future = pool.submit(
+                retry_api_call, session.get_wallet_balance, accountType="UNIFIED"
+            )
+            positions_future = pool.submit(
+                retry_api_call, session.get_positions, category="linear", symbol=CFG.symbol
+            )
+            balance_data = balance_future.result()
+            positions_data = positions_future.result()
         
         if balance_data is None:
             print("⚠️ Cannot get balance, using mock data...")
@@ -392,14 +427,7 @@ def check_account_status():
         account_info = balance_data['result']['list'][0]
         available_balance = float(account_info.get('totalAvailableBalance', 0))
         
-        # Get positions with retry
         print("📊 Checking positions...")
-        positions_data = retry_api_call(
-            session.get_positions,
-            category="linear",
-            symbol=SYMBOL
-        )
-        
         if positions_data is None:
             print("⚠️ Cannot get positions, assume 0 positions...")
             open_positions = []
@@ -409,13 +437,17 @@ def check_account_status():
         print(f"💰 Available Balance: ${available_balance:.2f}")
         print(f"📊 Open Positions: {len(open_positions)}")
         
-        for pos in open_positions:
-            print(f"   {pos['side']} {pos['size']} @ ${pos['avgPrice']} (PnL: ${pos['unrealisedPnl']})")
+        if open_positions:
+            # Gộp các dòng position vào một lần ghi stdout
+            print("\n".join(
+                f"   {pos['side']} {pos['size']} @ ${pos['avgPrice']} (PnL: ${pos['unrealisedPnl']})"
+                for pos in open_positions
+            ))
         
         return {
             'balance': available_balance,
             'positions': len(open_positions),
-            'can_trade': available_balance >= POSITION_SIZE_USDT and len(open_positions) == 0
+            'can_trade': available_balance >= CFG.position_size_usdt and len(open_positions) == 0
         }
         
     except Exception as e:
@@ -429,14 +461,18 @@ def main():
     """Main bot execution"""
     print("🚀 Starting SMC Bot...")
     
-    # Check account
-    account = check_account_status()
-    if not account['can_trade'] and AUTO_TRADE:
-        print("⚠️ Cannot trade - insufficient balance or open positions")
-        return
-    
-    # Get SMC signal
-    signal = get_smc_signal()
+    # Nến không phụ thuộc account -> lấy song song với account check
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        candles_future = pool.submit(fetch_candles)
+        
+        # Check account
+        account = check_account_status()
+        if not account['can_trade'] and CFG.auto_trade:
+            print("⚠️ Cannot trade - insufficient balance or open positions")
+            return
+        
+        # Get SMC signal
+        signal = get_smc_signal(candles_future)
     
     if signal:
         print(f"🎯 {signal['direction']} Signal Detected!")
@@ -446,9 +482,9 @@ def main():
         print(f"💡 Reason: {signal['reason']}")
         print(f"🔒 Confidence: {signal['confidence']}%")
         
-        if AUTO_TRADE:
+        if CFG.auto_trade:
             print("🤖 Auto-trading enabled - placing order...")
-            place_order_result = place_market_order(signal)
+            place_order_result = place_market_order(signal, account['balance'])
             if place_order_result:
                 print(f"✅ Order placed successfully! ID: {place_order_result}")
             else: